@@ -1,252 +1,416 @@
-import json
+import asyncio
 import os
-from datetime import datetime
-from functools import reduce as fold_l
+from datetime import datetime, timedelta, timezone
 
-import asyncpg
 import twint
 from twint import Config
-
-from i_database import DBConnection, DBRow, get_db_context
-from i_program_settings import get_all_settings
-from i_socket_io import get_sio
-from i_task import change_task_state
-
-from .text_analyzer import text_analyze
-
-
-async def crawl_user(
-    username, task_id, since: str, until: str, user_crawl: bool = True) -> int:
+from twint.storage.write_meta import tweetData
+
+from i_database import DBConnection, DBRows, get_db_context, hot_query
+from i_dictionary import apply_dictionary, get_dictionary
+from i_events import publish_event
+from i_metrics import (CRAWL_STAGE_SECONDS, TWEETS_ANALYZED, TWEETS_INSERTED,
+                       TWEETS_SCRAPED)
+from i_partitions import ensure_tweet_partitions, get_retention_cutoff
+from i_program_settings import get_all_settings, get_settings
+from i_progress import report_progress
+from i_token_frequency import add_tweet_tokens
+from i_user_stats import ADD_TWEETS_STATS
+
+from .text_analyzer import analyze_many
+
+#: 'tokens-saved' event has at most this number of hours
+TOKENS_SAVED_MAX_HOURS = 200
+
+#: also adds new tweets to stats of users
+TWEET_INSERT = hot_query('tweet-insert', f"""
+WITH inserted AS (
+    INSERT INTO public.tweet
+        (tweet_id, tweet_text, username, crawler_task, tweet_time)
+    SELECT
+        t.tweet_id, t.tweet_text, t.username, $5, t.tweet_time
+    FROM unnest($1::int8[], $2::varchar[], $3::varchar[], $4::timestamptz[])
+        AS t (tweet_id, tweet_text, username, tweet_time)
+    ON CONFLICT (tweet_id, tweet_time) DO NOTHING
+    RETURNING tweet_id, tweet_time, username
+), stats AS (
+{ADD_TWEETS_STATS}
+)
+SELECT tweet_id, tweet_time FROM inserted;
+""")
+
+
+async def crawl_user(username, task_id, since: str, until: str, percent_range: tuple = (0, 100)) -> int:
 
     """
-    This function, crawls a user
+    This function, crawls a user.
+    Tweets are saved in db while twint is crawling.
 
     Params
         username
         task_id: the id of task that crawles the tweets
         since: crawl from
         until: crawl until
-        user_crawl:
-            True -> crawler task is 'user-crawl' task
-            False -> crawl task is 'total-crawl' task or another
+        percent_range: percents of the task at start and end of this crawl, progress of the crawl is reported in it
 
     returns:
         count of tweets crawled
     """
 
-    #: json output file for twint
-    output_file = \
-        os.path.dirname(__file__) + \
-        f"/../outputfiles/tweets/{username}.{int(datetime.now().timestamp())}.json"
+    settings = get_all_settings()
+
+    #: json output file for twint, it is only used for debugging
+    output_file = None
+    if settings['save-twint-output-file']:
+        output_file = \
+            os.path.dirname(__file__) + \
+            f"/../outputfiles/tweets/{username}.{int(datetime.now().timestamp())}.json"
+
+    #: tweets are passed from twint to db through this queue.
+    #: when it is full, twint waits for saving tweets.
+    tweet_queue = asyncio.Queue(maxsize=settings['tweet-insert-batch-size'] * 2)
 
     #: create config of crawl
     conf = get_crawl_config(
         username,
         since,
         until,
-        output_file
+        output_file,
+        TweetStream(tweet_queue, asyncio.get_event_loop())
     )
 
-    if user_crawl:
-        print(f'[user-crawl][task:{task_id}][start crawling]')
+    async def tweet_load_callback(row_num, percent):
+        start, end = percent_range
+
+        await report_progress(
+            task_id,
+            f'crawling {username}, {row_num} tweets saved',
+            start + (end - start) * percent / 100
+        )
+
+    #: crawl with twint and save tweets
+    all_count = await crawl_save_tweets(
+        conf,
+        tweet_queue,
+        task_id,
+        tweet_load_callback
+    )
+
+    return all_count
+
+
+class TweetStream:
+    """
+    twint appends crawled tweets to this object (twint config: 'Store_object_tweets_list').
+    tweets are put in an async queue, in the thread of event loop.
+    twint runs in another thread, it waits while the queue is full.
+    """
+
+    def __init__(self, tweet_queue: asyncio.Queue, loop: asyncio.AbstractEventLoop):
+        self.tweet_queue = tweet_queue
+        self.loop = loop
+        self.closed = False
+
+    def append(self, tweet):
+        #: stops twint, if saving tweets is failed
+        if self.closed:
+            raise TweetStreamClosed()
+
+        with CRAWL_STAGE_SECONDS.time(stage='parse'):
+            tweet_dict = tweetData(tweet)
+
+        TWEETS_SCRAPED.inc()
+
+        asyncio.run_coroutine_threadsafe(
+            self.__put(tweet_dict),
+            self.loop
+        ).result()
+
+    def end(self):
+        """
+        puts END_OF_STREAM after twint ends, in the thread of event loop
+        """
+        asyncio.ensure_future(self.__put(END_OF_STREAM))
+
+    def close(self):
+        """
+        stops the stream when tweets are not read anymore, puts of twint become no-ops
+        """
+        self.closed = True
 
-        #: send state to socket
-        await get_sio().emit('task', {
-            'id': task_id,
-            'state': "crawling"
-        })
+        #: free the waiting twint thread
+        while not self.tweet_queue.empty():
+            self.tweet_queue.get_nowait()
 
-    #: crawl with twint
-    await twint.run.Twint(conf).main()
+    async def __put(self, item):
+        if not self.closed:
+            await self.tweet_queue.put(item)
+
+
+class TweetStreamClosed(Exception):
+    pass
+
+
+#: it is put in tweet queue, after twint ends
+END_OF_STREAM = object()
+
+
+async def crawl_save_tweets(
+    conf: Config, tweet_queue: asyncio.Queue, task_id, tweet_load_callback_async = None) -> int:
+    """
+    runs twint in a thread, and saves the tweets it crawls in db.
+
+    returns:
+        count of tweets crawled
+    """
+
+    tweet_stream: TweetStream = conf.Store_object_tweets_list
+
+    #: twint is not non-blocking ('time.sleep' is used in it), so it runs in a thread
+    scrape = asyncio.get_event_loop().run_in_executor(None, run_twint, conf)
+    scrape.add_done_callback(lambda _: tweet_stream.end())
 
     try:
-        async def tweet_load_callback(row_num, all_count):
-            if user_crawl:
-                await get_sio().emit('task', {
-                    'id': task_id,
-                    'state': f'analyze$save tweet {row_num} of {all_count}',
-                    'percent': row_num * 100 / all_count
-                })
-
-        #: extract tweets from twint output file
-        all_count = await extract_tweets(
-            output_file, 
-            task_id, 
-            tweet_load_callback
+        all_count = await save_tweet_stream(
+            tweet_queue,
+            task_id,
+            datetime.fromisoformat(conf.Since).replace(tzinfo=None),
+            datetime.fromisoformat(conf.Until).replace(tzinfo=None),
+            tweet_load_callback_async
         )
-    except FileNotFoundError:
-        all_count = 0
+    except BaseException:
+        #: twint stops at its next tweet (TweetStreamClosed)
+        tweet_stream.close()
+        scrape.cancel()
 
-    if user_crawl:
-        all_count_message = 'NO-TWEET' if all_count == 0 else all_count
+        #: the error of saving is raised, not the error of stopped twint
+        await asyncio.wait([scrape])
+        if not scrape.cancelled():
+            scrape.exception()
 
-        print(f'[user-crawl][task:{task_id}][analyze&save tweet end, {all_count_message} crawled]')
-        #: emit crawl end message
-        await get_sio().emit('task', {
-            'id': task_id,
-            'state': f'analyze&save tweet end, {all_count_message} crawled',
-        })
+        raise
 
-        #: change state of task
-        await change_task_state(task_id, f'{all_count} tweet crawled')
+    #: raises twint errors
+    await scrape
 
     return all_count
 
 
-async def extract_tweets(output_file, task_id, tweet_load_callback_async = None) -> int:
+def run_twint(conf: Config):
+    """
+    runs twint in an event loop of current thread
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
 
-    #: read count of 
-    with open(output_file) as o: 
-        all_count = fold_l(
-            lambda acc, x: acc + 1, 
-            o, 0
-        )
+    try:
+        with CRAWL_STAGE_SECONDS.time(stage='scrape'):
+            loop.run_until_complete(twint.run.Twint(conf).main())
+    finally:
+        loop.close()
+
+
+async def save_tweet_stream(
+    tweet_queue: asyncio.Queue,
+    task_id,
+    since: datetime,
+    until: datetime,
+    tweet_load_callback_async = None
+) -> int:
+    """
+    reads tweets from the queue, until END_OF_STREAM, and saves them (and their tokens) in db.
+    tweets are saved in batches, the size of batches is specified by
+    'tweet-insert-batch-size' in program settings.
+    if twint is slow, smaller batches are saved after 'tweet-stream-flush-second'.
+
+    returns:
+        count of tweets read from queue
+    """
+
+    settings = get_all_settings()
+    batch_size = settings['tweet-insert-batch-size']
+    flush_second = settings['tweet-stream-flush-second']
 
     row_num = 0
+    batch = []
+    stream_ended = False
+
+    while not stream_ended:
+        try:
+            tweet = await asyncio.wait_for(tweet_queue.get(), timeout=flush_second)
+        except asyncio.TimeoutError:
+            tweet = None
+
+        if tweet is END_OF_STREAM:
+            stream_ended = True
+        elif tweet is not None:
+            row_num += 1
+            batch.append(tweet)
+
+        if batch and (stream_ended or tweet is None or len(batch) >= batch_size):
+            await tweets_batch_save_db(batch, task_id)
+
+            if tweet_load_callback_async:
+                await tweet_load_callback_async(
+                    row_num,
+                    crawl_percent(batch[-1], since, until)
+                )
+
+            batch = []
 
-    with open(output_file, 'r') as json_file:
-        #: every line of output is a tweet
-        for line in json_file:
+    return row_num
 
-            row_num +=1
-            if tweet_load_callback_async: await tweet_load_callback_async(row_num, all_count)
 
-            #: load it
-            tweet: dict = json.loads(line)
+def crawl_percent(tweet_dict: dict, since: datetime, until: datetime) -> float:
+    """
+    twint crawls tweets from 'until' to 'since',
+    so the percent of crawl is found by the time of last crawled tweet.
+    """
+    tweet_time = datetime.fromisoformat(f'{tweet_dict["date"]} {tweet_dict["time"]}')
 
-            try:
-                #: save tweet in db
-                await tweet_save_db(tweet, task_id)
+    if until <= since:
+        return 100
 
-                #: analyze tweet and save tokens in db
-                await analyze_save_db(
-                    await text_analyze(tweet['tweet']),
-                    tweet['id']
-                )
+    percent = (until - tweet_time) * 100 / (until - since)
 
-            #: don't attention to duplicates
-            except asyncpg.exceptions.UniqueViolationError as e:
-                pass
-            except Exception as e:
-                raise e
+    return min(max(percent, 0), 100)
 
-    return all_count
+
+def get_tweet_time(tweet_dict: dict) -> datetime:
+    """
+    returns time of a tweet of twint, with its timezone
+    """
+    return datetime.strptime(
+        f'{tweet_dict["date"]} {tweet_dict["time"]}{tweet_dict["timezone"]}',
+        '%Y-%m-%d %H:%M:%S%z'
+    )
+
+
+async def tweets_batch_save_db(tweet_dicts: list, task_id):
+    """
+    saves a batch of tweets in db, then analyzes the new ones and saves their tokens.
+    tweets that exist in db already, are skipped.
+    """
+
+    with CRAWL_STAGE_SECONDS.time(stage='save'):
+        saved_ids = await tweets_save_db(tweet_dicts, task_id)
+
+    TWEETS_INSERTED.inc(len(saved_ids))
+
+    new_tweets = []
+    for tweet in tweet_dicts:
+        if tweet['id'] not in saved_ids:
+            continue
+
+        #: a tweet may be repeated in a batch
+        new_tweets.append((tweet, saved_ids.pop(tweet['id'])))
+
+    #: analyze tweets in analyzer processes
+    with CRAWL_STAGE_SECONDS.time(stage='analyze'):
+        tokens_list = await analyze_many([tweet['tweet'] for tweet, _ in new_tweets])
+
+    TWEETS_ANALYZED.inc(len(new_tweets))
+
+    analyzed_tweets = [
+        (tweet['id'], tweet_time, tokens) for (tweet, tweet_time), tokens in zip(new_tweets, tokens_list)
+    ]
+
+    #: save tokens of all tweets in db
+    with CRAWL_STAGE_SECONDS.time(stage='save'):
+        await analyze_save_db(analyzed_tweets)
 
 
-async def tweet_save_db(tweet_dict: dict, task_id):
+async def tweets_save_db(tweet_dicts: list, task_id) -> dict:
     """
-    saves a tweet in database
+    saves a batch of tweets in database, with one multi-row insert.
+    duplicate tweets are ignored by db.
+    tweets older than retention of tweets (see i_partitions) are not saved.
 
     task_id: it is used for show the tweet is for which crawling task
+
+    returns:
+        'tweet_id' -> 'tweet_time' of the tweets that are inserted
     """
+    cutoff = get_retention_cutoff()
+
+    tweets = [(t, get_tweet_time(t)) for t in tweet_dicts]
+    tweets = [(t, time) for t, time in tweets if cutoff is None or time >= cutoff]
+
+    if not tweets:
+        return {}
+
+    await ensure_tweet_partitions([time for _, time in tweets])
+
     conn: DBConnection
     async with await get_db_context() as conn:
         async with conn.transaction():
 
-            tweet_time = f'{tweet_dict["date"]} {tweet_dict["time"]}{tweet_dict["timezone"]}'
-            await conn.execute(
-                f"""
-                INSERT INTO public.tweet
-                (tweet_id, tweet_text, username, crawler_task, tweet_time)
-                VALUES(
-                    $1, $2, $3, $4,
-                    '{tweet_time}');
-                """,
-                tweet_dict['id'],
-                tweet_dict['tweet'],
-                tweet_dict['username'],
+            rows: DBRows = await (await conn.hot(TWEET_INSERT)).fetch(
+                [t['id'] for t, _ in tweets],
+                [t['tweet'] for t, _ in tweets],
+                [t['username'] for t, _ in tweets],
+                [time for _, time in tweets],
                 task_id
             )
 
+            return {row.get('tweet_id'): row.get('tweet_time') for row in rows}
 
-async def analyze_save_db(analyze_list: list, tweet_id):
+
+async def analyze_save_db(analyzed_tweets: list):
     """
-    This function saves the list of tokens is db.
+    This function saves the tokens of some tweets in db, with one multi-row insert.
     It also checks the 'dictionary' finding that a token must be replaced or deleted.
+
+    analyzed_tweets: list of (tweet_id, tweet_time, list of tokens)
     """
 
-    for token in analyze_list:
-        conn: DBConnection
-        async with await get_db_context() as conn:
-            async with conn.transaction():
+    dictionary = await get_dictionary()
 
-                #: check the 'dictionary' for token
-                row: DBRow = await conn.fetchrow(
-                    'SELECT replace_with FROM public."dictionary" where "token" = $1;', token
-                )
-
-                #: if exists in 'dictionary'
-                if row:
-                    replace_with = row.get('replace_with')
-
-                    #: if it must be replaced with another token
-                    if replace_with:
-                        await conn.execute(
-                            'INSERT INTO public.tweet_token (tweet_id, "token") VALUES($1, $2);',
-                            tweet_id, replace_with
-                        )
-                    
-                    #: or if it shouldn't be inserted in db
-                    else:
-                        continue
-                else:
-                    await conn.execute(
-                        'INSERT INTO public.tweet_token (tweet_id, "token") VALUES($1, $2);',
-                        tweet_id, token
-                    )
-
-
-async def crawl_total(task_id, since: str, until: str) -> tuple:
-    """
-    This function:
-        1- checks for user that must be crawled
-        2- crawl them one by one
+    tweet_ids = []
+    tweet_times = []
+    tokens = []
+    for tweet_id, tweet_time, analyze_list in analyzed_tweets:
+        for token in apply_dictionary(dictionary, analyze_list):
+            tweet_ids.append(tweet_id)
+            tweet_times.append(tweet_time)
+            tokens.append(token)
 
-    returns:
-        - count of all tweets crawled
-        - count of all users crawled
-    """
+    if not tokens:
+        return
 
-    #: open db connection
     conn: DBConnection
     async with await get_db_context() as conn:
         async with conn.transaction():
+            #: also adds the tokens to 'token_frequency'
+            added_frequencies = await add_tweet_tokens(conn, tweet_ids, tweet_times, tokens)
 
-            #: read db all users that can be crawled
-            all_user_count = (
-                await conn.fetchrow('select count("username") from "twitter_user" where "iscrawl";')
-            ).get('count')
-
-            user_num = 0
-
-            all_tweet_crawled_count = 0
-
-            row: DBRow
-            async for row in conn.cursor('select "username" from "twitter_user" where "iscrawl";'):
-                user_num += 1
-
-                #: emit state to client
-                await get_sio().emit('task', {
-                    "id": task_id,
-                    "state": f"crawling user: {row.get('username')}",
-                    "percent": user_num * 100 / all_user_count
-                })
-
-                #: crawl user
-                crawl_count = await crawl_user(
-                    row.get('username'),
-                    task_id,
-                    since,
-                    until,
-                    user_crawl=False
-                )
+    await publish_tokens_saved(added_frequencies)
 
-                all_tweet_crawled_count += crawl_count
 
-    return all_user_count, all_tweet_crawled_count
+async def publish_tokens_saved(added_frequencies: DBRows):
+    """
+    api servers update their caches (charts of the users, trends of the hours) by this event
+    """
+    memory_since = datetime.now(timezone.utc) - timedelta(hours=get_settings('trends-memory-hour') + 1)
+
+    if not added_frequencies:
+        return
 
+    all_hours = [row.get('hour_bucket') for row in added_frequencies]
 
-def get_crawl_config(username, since: str, until: str, output_file):
+    hours = set(h for h in all_hours if h >= memory_since)
+
+    await publish_event('tokens-saved', {
+        "usernames": list(set(row.get('username') for row in added_frequencies)),
+        #: charts of this range are changed
+        "first-hour": min(all_hours).isoformat(),
+        "last-hour": max(all_hours).isoformat(),
+        #: all trends are read again, if many hours are changed (size of events is limited)
+        "hours": [h.isoformat() for h in hours] if len(hours) <= TOKENS_SAVED_MAX_HOURS else None
+    })
+
+
+def get_crawl_config(username, since: str, until: str, output_file, tweet_stream: TweetStream):
     c = Config()
 
     #: copied from: twint lib -> run.py -> Search function
@@ -257,14 +421,21 @@ def get_crawl_config(username, since: str, until: str, output_file):
     c.Profile = False
     c.Profile_full = False
 
-    c.Output = output_file
     c.Username = username
-    c.Store_json = True
     c.Format = "{username} | id: {id}"
     c.Until = until
     c.Since = since
     c.Filter_retweets = True
 
+    #: crawled tweets are passed to 'tweet_stream'
+    c.Store_object = True
+    c.Store_object_tweets_list = tweet_stream
+
+    #: json output file, for debugging
+    if output_file:
+        c.Output = output_file
+        c.Store_json = True
+
     #: configs from program_settings
     setting = get_all_settings()
     if setting["use-proxy"]:
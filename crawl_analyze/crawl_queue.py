@@ -0,0 +1,406 @@
+"""
+This module keeps the queue of crawls in db ('crawl_job' table).
+
+A crawl task is split to jobs: crawl of a user in a time slice ('crawl-slice-hour' in program settings).
+Workers claim jobs by 'FOR UPDATE SKIP LOCKED', so a job is crawled by only one worker.
+A job is done when its tweets are saved. After a restart, unfinished jobs are crawled again
+and done jobs are not, so a crawl resumes where it stopped.
+
+Many worker processes (on many hosts) can share the queue. A worker keeps its running jobs claimed
+by updating 'claimed_at'; jobs of a stopped worker are claimed by others after 'crawl-job-lease-second'.
+
+A failed job is pending again, and it is claimed after a backoff ('crawl-job-retry-backoff-second',
+doubled on every attempt). It fails finally after 'crawl-job-max-attempts' attempts.
+A total crawl task is not created while jobs of former total crawls are unfinished,
+so the end of last total crawl (the start of next one) does not pass their time slices.
+
+When a task is created (also in api server), a 'crawl-jobs-created' event wakes up idle workers
+of all processes (see i_events), they don't wait for 'crawl-queue-poll-second'.
+"""
+
+import asyncio
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from i_database import DBConnection, DBRow, DBRows, get_db_context
+from i_events import publish_event, subscribe_event
+from i_program_settings import get_all_settings, get_settings
+from i_progress import report_progress
+from i_task import change_task_state, create_task
+from i_user_stats import set_user_crawled
+
+from .crawl import crawl_user
+
+#: format of 'since' and 'until' of twint
+CRAWL_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+#: it is set when jobs are added, so idle workers don't wait for next poll
+__new_jobs = asyncio.Event()
+
+#: name of this worker process, jobs are claimed by it
+WORKER_NAME = f'{socket.gethostname()}:{os.getpid()}'
+
+#: only one of workers creates a total crawl task, by this lock
+TOTAL_CRAWL_LOCK_KEY = 19871
+
+
+def split_time_range(since: datetime, until: datetime, slice_hour: float) -> List[tuple]:
+    """
+    splits a time range to slices of 'slice_hour' hours (the last one can be shorter)
+    """
+    slices = []
+
+    slice_since = since
+    while slice_since < until:
+        slice_until = min(slice_since + timedelta(hours=slice_hour), until)
+        slices.append((slice_since, slice_until))
+        slice_since = slice_until
+
+    return slices
+
+
+async def create_crawl_task(
+    task_type, since: datetime, until: datetime, usernames: list = None, task_user=None) -> int:
+    """
+    creates a crawl task, and its jobs in the queue
+
+    usernames: users that are crawled, all users with crawl permission if not specified
+
+    returns:
+        id of the task
+    """
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        async with conn.transaction():
+            task_id = await __insert_crawl_task(
+                conn, task_type, since, until, usernames, task_user
+            )
+
+    await __notify_new_jobs(task_id)
+
+    return task_id
+
+
+async def create_total_crawl_task(interval_hour: float) -> Optional[int]:
+    """
+    creates a 'total-crawl' task, from the end of last one until now,
+    if the last one is older than 'interval_hour'.
+    workers call it together, only one of them creates the task.
+
+    returns:
+        id of the task, or None if it is not created (it is not the time, or former jobs are unfinished)
+    """
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        async with conn.transaction():
+            await conn.execute('SELECT pg_advisory_xact_lock($1);', TOTAL_CRAWL_LOCK_KEY)
+
+            #: waits for unfinished jobs (retries) of former total crawls
+            if await conn.fetchval(
+                '''
+                SELECT EXISTS (
+                    SELECT 1 FROM public.crawl_job j
+                    JOIN public.program_task t ON t.id = j.task_id
+                    WHERE t.task_type = 'total-crawl' and j.job_status IN ('pending', 'running')
+                );
+                '''
+            ):
+                return None
+
+            last_until: datetime = await conn.fetchval(
+                "SELECT max(crawl_until) FROM public.program_task WHERE task_type = 'total-crawl';"
+            )
+
+            until = datetime.now()
+            if last_until and until - last_until < timedelta(hours=interval_hour):
+                return None
+
+            task_id = await __insert_crawl_task(
+                conn,
+                'total-crawl',
+                last_until or until - timedelta(hours=interval_hour),
+                until
+            )
+
+    await __notify_new_jobs(task_id)
+
+    return task_id
+
+
+async def __insert_crawl_task(
+    conn: DBConnection, task_type, since: datetime, until: datetime, usernames: list = None, task_user=None) -> int:
+    slices = split_time_range(since, until, get_settings('crawl-slice-hour'))
+
+    if usernames is None:
+        rows: DBRows = await conn.fetch(
+            'select "username" from "twitter_user" where "iscrawl";'
+        )
+        usernames = [row.get('username') for row in rows]
+
+    task_id = await create_task(
+        task_type, 'not started', since, until, task_user, conn
+    )
+
+    await conn.execute(
+        '''
+        INSERT INTO public.crawl_job (task_id, username, slice_since, slice_until)
+        SELECT $1, u.username, s.slice_since, s.slice_until
+        FROM
+            unnest($2::varchar[]) AS u (username),
+            unnest($3::timestamp[], $4::timestamp[]) AS s (slice_since, slice_until)
+        ORDER BY s.slice_since, u.username;
+        ''',
+        task_id,
+        usernames,
+        [s[0] for s in slices],
+        [s[1] for s in slices]
+    )
+
+    #: a task without jobs is done
+    if not usernames or not slices:
+        await conn.execute(
+            "UPDATE public.program_task SET task_status='done', task_state='nothing to crawl' WHERE id=$1;",
+            task_id
+        )
+
+    return task_id
+
+
+async def get_last_crawl_until(task_type) -> Optional[datetime]:
+    """
+    returns end of time range of the last task of a type
+    """
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        return await conn.fetchval(
+            'SELECT max(crawl_until) FROM public.program_task WHERE task_type = $1;',
+            task_type
+        )
+
+
+async def __notify_new_jobs(task_id):
+    __new_jobs.set()
+
+    #: jobs are saved, workers find them by polling if the event is lost
+    try:
+        await publish_event('crawl-jobs-created', {'task_id': task_id})
+    except Exception as e:
+        print(f'[crawl-queue][task:{task_id}][event error][{e}]')
+
+
+async def run_crawl_queue():
+    """
+    crawls jobs of the queue, by 'crawl-workers' concurrent workers.
+    'listen_events' of i_events must run too, for waking up by new jobs of other processes.
+    """
+    subscribe_event('crawl-jobs-created', lambda data: __new_jobs.set())
+
+    await asyncio.gather(*(
+        __crawl_worker() for _ in range(get_settings('crawl-workers'))
+    ))
+
+
+async def __crawl_worker():
+    while True:
+        settings = get_all_settings()
+
+        __new_jobs.clear()
+
+        try:
+            job = await __claim_job()
+        except Exception as e:
+            print(f'[crawl-queue][error][{e}]')
+            job = None
+
+        if job is None:
+            try:
+                await asyncio.wait_for(__new_jobs.wait(), settings['crawl-queue-poll-second'])
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        task_id = job.get('task_id')
+
+        heartbeat = asyncio.ensure_future(
+            __keep_claim(job.get('id'), settings['crawl-job-lease-second'] / 3)
+        )
+
+        #: percent of the task, before and after this job
+        percent_range = (
+            job.get('finished_job_count') * 100 / job.get('job_count'),
+            (job.get('finished_job_count') + 1) * 100 / job.get('job_count')
+        )
+
+        #: a failed job is retried by the queue (see '__finish_job')
+        try:
+            tweet_count = await crawl_user(
+                job.get('username'),
+                task_id,
+                job.get('slice_since').strftime(CRAWL_TIME_FORMAT),
+                job.get('slice_until').strftime(CRAWL_TIME_FORMAT),
+                percent_range
+            )
+        except Exception as e:
+            print(f'[crawl-queue][task:{task_id}][user:{job.get("username")}][failed][{e}]')
+            tweet_count = None
+        finally:
+            heartbeat.cancel()
+
+        try:
+            await __finish_job(job, tweet_count)
+        except Exception as e:
+            print(f'[crawl-queue][task:{task_id}][error][{e}]')
+
+        #: rate limit of worker
+        await asyncio.sleep(settings['crawl-worker-delay-second'])
+
+
+async def __claim_job() -> Optional[DBRow]:
+    """
+    takes the oldest pending job (that its retry time is passed), or a running job that its worker is stopped
+    """
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        async with conn.transaction():
+            job: DBRow = await conn.fetchrow(
+                '''
+                UPDATE public.crawl_job j
+                SET job_status = 'running', claimed_at = now(), claimed_by = $1, attempt_count = j.attempt_count + 1
+                WHERE j.id = (
+                    SELECT id FROM public.crawl_job
+                    WHERE
+                        (job_status = 'pending' and (retry_at is null or retry_at <= now())) or
+                        (job_status = 'running' and claimed_at < now() - make_interval(secs => $2))
+                    ORDER BY id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING
+                    j.id, j.task_id, j.username, j.slice_since, j.slice_until, j.attempt_count,
+                    (SELECT count(1) FROM public.crawl_job c WHERE c.task_id = j.task_id) AS job_count,
+                    (
+                        SELECT count(1) FROM public.crawl_job c
+                        WHERE c.task_id = j.task_id and c.job_status IN ('done', 'failed')
+                    ) AS finished_job_count;
+                ''',
+                WORKER_NAME,
+                get_settings('crawl-job-lease-second')
+            )
+
+            if job is not None:
+                await conn.execute(
+                    "UPDATE public.program_task SET task_status='running' WHERE id=$1 and task_status='pending';",
+                    job.get('task_id')
+                )
+
+    return job
+
+
+async def __keep_claim(job_id, interval_second: float):
+    """
+    updates 'claimed_at' of a running job periodically, so other workers don't claim it
+    """
+    while True:
+        await asyncio.sleep(interval_second)
+
+        try:
+            conn: DBConnection
+            async with await get_db_context() as conn:
+                await conn.execute(
+                    'UPDATE public.crawl_job SET claimed_at = now() WHERE id = $1 and claimed_by = $2;',
+                    job_id, WORKER_NAME
+                )
+        except Exception as e:
+            print(f'[crawl-queue][job:{job_id}][error][{e}]')
+
+
+async def __finish_job(job: DBRow, tweet_count: Optional[int]):
+    """
+    saves result of a job (tweet_count is None for failed job), and progress of its task.
+    a failed job is pending again (with backoff), if it has attempts.
+    """
+    settings = get_all_settings()
+
+    task_id = job.get('task_id')
+    attempt_count = job.get('attempt_count')
+
+    retry = tweet_count is None and attempt_count < settings['crawl-job-max-attempts']
+
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        if retry:
+            retry_second = settings['crawl-job-retry-backoff-second'] * 2 ** (attempt_count - 1)
+
+            await conn.execute(
+                '''
+                UPDATE public.crawl_job
+                SET job_status = 'pending', claimed_by = NULL, retry_at = now() + make_interval(secs => $2)
+                WHERE id = $1 and claimed_by = $3;
+                ''',
+                job.get('id'),
+                retry_second,
+                WORKER_NAME
+            )
+
+            print(
+                f'[crawl-queue][task:{task_id}][{job.get("username")}]'
+                f'[attempt {attempt_count} failed, retry after {retry_second} seconds]'
+            )
+        else:
+            await conn.execute(
+                '''
+                UPDATE public.crawl_job
+                SET job_status = $2, tweet_count = $3, finished_at = now()
+                WHERE id = $1 and claimed_by = $4;
+                ''',
+                job.get('id'),
+                'failed' if tweet_count is None else 'done',
+                tweet_count or 0,
+                WORKER_NAME
+            )
+
+        if tweet_count is not None:
+            await set_user_crawled(conn, job.get('username'), task_id)
+
+        progress: DBRow = await conn.fetchrow(
+            '''
+            SELECT
+                count(1) AS all_count,
+                count(1) FILTER (WHERE job_status IN ('done', 'failed')) AS finished_count,
+                count(DISTINCT username) AS user_count,
+                coalesce(sum(tweet_count), 0) AS tweet_count,
+                array_agg(DISTINCT username) FILTER (WHERE job_status = 'failed') AS failed_users
+            FROM public.crawl_job
+            WHERE task_id = $1;
+            ''',
+            task_id
+        )
+
+    all_count = progress.get('all_count')
+    finished_count = progress.get('finished_count')
+
+    if finished_count < all_count:
+        state = f'crawled {finished_count} of {all_count} jobs, {progress.get("tweet_count")} tweets'
+        status = None
+    else:
+        state = f'crawled:{progress.get("tweet_count")} tweets of {progress.get("user_count")} user'
+        status = 'done'
+
+        if progress.get('failed_users'):
+            state += f', failed users: {", ".join(progress.get("failed_users"))}'
+            status = 'failed'
+
+            print(f'[crawl-queue][task:{task_id}][failed users][{", ".join(progress.get("failed_users"))}]')
+
+        print(f'[crawl-queue][task:{task_id}][end crawl][{state}]')
+
+    await change_task_state(task_id, state, status)
+
+    await report_progress(
+        task_id,
+        state,
+        finished_count * 100 / all_count,
+        final=status in ('done', 'failed')
+    )
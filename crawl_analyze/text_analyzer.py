@@ -1,18 +1,90 @@
+"""
+Text analyzer of tweets.
+hazm works are cpu-bound, so they are done in a pool of processes (one per cpu core),
+and every process builds hazm objects once.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
 from hazm import Lemmatizer, Normalizer, word_tokenize
 
+#: hazm objects of the worker process
+__normalizer: Normalizer = None
+__lemmatizer: Lemmatizer = None
+
+#: analyzer processes
+__executor: ProcessPoolExecutor = None
+
+
+async def analyze_many(texts: List[str]) -> List[List[str]]:
+    """
+    analyzes some texts in analyzer processes.
+
+    returns:
+        list of tokens for each text, in order of 'texts'
+    """
+
+    if not texts:
+        return []
+
+    executor = __get_executor()
+    loop = asyncio.get_event_loop()
+
+    #: split texts between workers
+    chunk_size = -(-len(texts) // os.cpu_count())
+    chunks = [
+        texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)
+    ]
+
+    results = await asyncio.gather(*(
+        loop.run_in_executor(executor, _analyze_chunk, chunk)
+        for chunk in chunks
+    ))
+
+    return [tokens for chunk_result in results for tokens in chunk_result]
+
+
+def __get_executor() -> ProcessPoolExecutor:
+    global __executor
+
+    if __executor is None:
+        __executor = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            initializer=_init_worker
+        )
+
+    return __executor
+
+
+def _init_worker():
+    """
+    builds hazm objects, runs once in every analyzer process
+    """
+    global __normalizer, __lemmatizer
+
+    __normalizer = Normalizer()
+    __lemmatizer = Lemmatizer()
+
+
+def _analyze_chunk(texts: List[str]) -> List[List[str]]:
+    """
+    runs in analyzer process
+    """
+    return [_analyze(text) for text in texts]
 
-async def text_analyze(text: str) -> list:
-    normalizer = Normalizer()
-    lemmatizer = Lemmatizer()
 
-    text_norm = normalizer.normalize(text)
+def _analyze(text: str) -> List[str]:
+    text_norm = __normalizer.normalize(text)
 
     token_list = tuple(
         word_tokenize(text_norm)
     )
 
     token_list_lem = tuple(map(
-        lemmatizer.lemmatize,
+        __lemmatizer.lemmatize,
         token_list
     ))
 
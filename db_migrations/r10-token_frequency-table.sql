@@ -0,0 +1,8 @@
+CREATE TABLE public.token_frequency (
+	"token" varchar NOT NULL,
+	hour_bucket timestamptz NOT NULL,
+	username varchar NOT NULL,
+	count int8 NOT NULL DEFAULT 0,
+	CONSTRAINT token_frequency_pk PRIMARY KEY ("token", hour_bucket, username),
+	CONSTRAINT token_frequency_fk FOREIGN KEY (username) REFERENCES public.twitter_user(username) ON DELETE CASCADE ON UPDATE CASCADE
+);
@@ -0,0 +1,11 @@
+-- tokens of 'tweet_token' are searched without tweet_id (dictionary, token frequency)
+CREATE INDEX IF NOT EXISTS tweet_token_token_idx ON public.tweet_token USING btree ("token", tweet_id);
+
+-- tweets of a user in a time range (user api)
+CREATE INDEX IF NOT EXISTS tweet_username_tweet_time_idx ON public.tweet USING btree (username, tweet_time);
+
+-- tweets are inserted nearly in order of time, so a small brin index is enough for time ranges
+CREATE INDEX IF NOT EXISTS tweet_tweet_time_brin_idx ON public.tweet USING brin (tweet_time);
+
+-- task api is ordered by crawl_until
+CREATE INDEX IF NOT EXISTS program_task_crawl_until_idx ON public.program_task USING btree (crawl_until, id);
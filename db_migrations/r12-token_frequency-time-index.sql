@@ -0,0 +1,2 @@
+-- trends api sums all tokens of a time range
+CREATE INDEX IF NOT EXISTS token_frequency_hour_bucket_idx ON public.token_frequency USING btree (hour_bucket) INCLUDE ("token", username, count);
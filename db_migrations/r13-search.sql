@@ -0,0 +1,18 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- distinct tokens of 'tweet_token', for searching tokens
+CREATE TABLE public."token" (
+	"token" varchar NOT NULL,
+	CONSTRAINT token_pk PRIMARY KEY ("token")
+);
+
+INSERT INTO public."token" ("token") SELECT DISTINCT "token" FROM public.tweet_token;
+
+-- substring search of tokens
+CREATE INDEX token_token_trgm_idx ON public."token" USING gin ("token" gin_trgm_ops);
+
+-- prefix search of tokens
+CREATE INDEX token_token_prefix_idx ON public."token" USING btree ("token" varchar_pattern_ops);
+
+-- full text search of tweets
+CREATE INDEX tweet_tweet_text_fts_idx ON public.tweet USING gin (to_tsvector('simple', tweet_text));
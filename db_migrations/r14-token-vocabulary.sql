@@ -0,0 +1,36 @@
+-- 'token' becomes the vocabulary: every token has an id and its count in all tweets
+ALTER TABLE public."token" ADD id serial NOT NULL;
+ALTER TABLE public."token" ADD total_count int8 NOT NULL DEFAULT 0;
+ALTER TABLE public."token" DROP CONSTRAINT token_pk;
+ALTER TABLE public."token" ADD CONSTRAINT token_pk PRIMARY KEY (id);
+ALTER TABLE public."token" ADD CONSTRAINT token_token_key UNIQUE ("token");
+
+-- tokens of tweets reference the vocabulary by id
+ALTER TABLE public.tweet_token ADD token_id int4 NULL;
+
+UPDATE public.tweet_token tt SET token_id = tk.id
+FROM public."token" tk
+WHERE tk."token" = tt."token";
+
+DELETE FROM public.tweet_token WHERE token_id IS NULL;
+
+-- also drops 'tweet_token_pk' and 'tweet_token_token_idx'
+ALTER TABLE public.tweet_token DROP COLUMN "token";
+ALTER TABLE public.tweet_token ALTER COLUMN token_id SET NOT NULL;
+ALTER TABLE public.tweet_token ADD CONSTRAINT tweet_token_pk PRIMARY KEY (tweet_id, token_id);
+ALTER TABLE public.tweet_token ADD CONSTRAINT tweet_token_token_fk FOREIGN KEY (token_id) REFERENCES public."token"(id);
+
+-- tweets of a token (dictionary, token frequency)
+CREATE INDEX tweet_token_token_id_idx ON public.tweet_token USING btree (token_id, tweet_id);
+
+UPDATE public."token" tk SET total_count = c.count
+FROM (
+	SELECT token_id, count(1) AS count FROM public.tweet_token GROUP BY 1
+) c
+WHERE tk.id = c.token_id;
+
+-- token explorer lists tokens by total count
+CREATE INDEX token_total_count_idx ON public."token" USING btree (total_count, id);
+
+-- gives back the space of dropped column (can not run in a transaction)
+VACUUM FULL public.tweet_token;
@@ -0,0 +1,26 @@
+-- status of a task: 'pending', 'running', 'done', 'failed'
+ALTER TABLE public.program_task ADD task_status varchar NOT NULL DEFAULT 'done';
+ALTER TABLE public.program_task ALTER COLUMN task_status SET DEFAULT 'pending';
+
+-- crawl of a user in a time slice, for a crawl task.
+-- the queue of crawler: jobs are claimed by 'FOR UPDATE SKIP LOCKED', a done job is never crawled again
+CREATE TABLE public.crawl_job (
+	id serial NOT NULL,
+	task_id int4 NOT NULL,
+	username varchar NOT NULL,
+	slice_since timestamp NOT NULL,
+	slice_until timestamp NOT NULL,
+	job_status varchar NOT NULL DEFAULT 'pending',
+	tweet_count int4 NOT NULL DEFAULT 0,
+	claimed_at timestamptz NULL,
+	finished_at timestamptz NULL,
+	CONSTRAINT crawl_job_pk PRIMARY KEY (id),
+	CONSTRAINT crawl_job_task_fk FOREIGN KEY (task_id) REFERENCES public.program_task(id) ON DELETE CASCADE ON UPDATE CASCADE,
+	CONSTRAINT crawl_job_user_fk FOREIGN KEY (username) REFERENCES public.twitter_user(username) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+-- progress of a task
+CREATE INDEX crawl_job_task_id_idx ON public.crawl_job USING btree (task_id, job_status);
+
+-- claiming next job
+CREATE INDEX crawl_job_unfinished_idx ON public.crawl_job USING btree (id) WHERE job_status IN ('pending', 'running');
@@ -0,0 +1,2 @@
+-- worker process that claimed a job (host:pid)
+ALTER TABLE public.crawl_job ADD claimed_by varchar NULL;
@@ -0,0 +1,98 @@
+-- 'tweet' and 'tweet_token' are partitioned by month of 'tweet_time' (needs postgres 12 or newer).
+-- partitions are created ahead by 'create_tweet_partitions', and old months are
+-- dropped or archived as whole partitions (see i_partitions).
+
+-- detached partitions of old months are moved to this schema (retention mode 'archive')
+CREATE SCHEMA IF NOT EXISTS archive;
+
+-- creates missing partitions of the months in a time range ('tweet_YYYY_MM' and 'tweet_token_YYYY_MM').
+-- months are in UTC. returns count of created months.
+CREATE OR REPLACE FUNCTION public.create_tweet_partitions(since timestamptz, until timestamptz) RETURNS int4
+LANGUAGE plpgsql AS $$
+DECLARE
+	month_start timestamp := date_trunc('month', since AT TIME ZONE 'UTC');
+	month_suffix varchar;
+	created_count int4 := 0;
+BEGIN
+	-- workers create partitions together
+	PERFORM pg_advisory_xact_lock(19872);
+
+	WHILE month_start AT TIME ZONE 'UTC' <= until LOOP
+		month_suffix := to_char(month_start, 'YYYY_MM');
+
+		IF to_regclass('public.tweet_' || month_suffix) IS NULL THEN
+			EXECUTE format(
+				'CREATE TABLE public.%I PARTITION OF public.tweet FOR VALUES FROM (%L) TO (%L);',
+				'tweet_' || month_suffix,
+				month_start AT TIME ZONE 'UTC',
+				(month_start + interval '1 month') AT TIME ZONE 'UTC'
+			);
+			EXECUTE format(
+				'CREATE TABLE public.%I PARTITION OF public.tweet_token FOR VALUES FROM (%L) TO (%L);',
+				'tweet_token_' || month_suffix,
+				month_start AT TIME ZONE 'UTC',
+				(month_start + interval '1 month') AT TIME ZONE 'UTC'
+			);
+
+			created_count := created_count + 1;
+		END IF;
+
+		month_start := month_start + interval '1 month';
+	END LOOP;
+
+	RETURN created_count;
+END
+$$;
+
+-- a tweet without time can not be in a partition
+DELETE FROM public.tweet WHERE tweet_time IS NULL;
+
+ALTER TABLE public.tweet RENAME TO tweet_unpartitioned;
+ALTER TABLE public.tweet_token RENAME TO tweet_token_unpartitioned;
+
+CREATE TABLE public.tweet (
+	tweet_id int8 NOT NULL,
+	tweet_text varchar NULL,
+	username varchar NULL,
+	tweet_time timestamptz NOT NULL,
+	crawler_task int4 NULL
+) PARTITION BY RANGE (tweet_time);
+
+-- 'tweet_time' of tokens is the time of their tweet, so tokens are in the partition of their tweet
+CREATE TABLE public.tweet_token (
+	tweet_id int8 NOT NULL,
+	token_id int4 NOT NULL,
+	tweet_time timestamptz NOT NULL
+) PARTITION BY RANGE (tweet_time);
+
+SELECT public.create_tweet_partitions(
+	coalesce((SELECT min(tweet_time) FROM public.tweet_unpartitioned), now()),
+	now() + interval '3 months'
+);
+
+INSERT INTO public.tweet (tweet_id, tweet_text, username, tweet_time, crawler_task)
+SELECT tweet_id, tweet_text, username, tweet_time, crawler_task FROM public.tweet_unpartitioned;
+
+INSERT INTO public.tweet_token (tweet_id, token_id, tweet_time)
+SELECT tt.tweet_id, tt.token_id, t.tweet_time
+FROM public.tweet_token_unpartitioned tt
+JOIN public.tweet_unpartitioned t ON t.tweet_id = tt.tweet_id;
+
+-- also frees names of their constraints and indexes
+DROP TABLE public.tweet_token_unpartitioned;
+DROP TABLE public.tweet_unpartitioned;
+
+-- a unique key of partitioned table must have the partition key
+ALTER TABLE public.tweet ADD CONSTRAINT tweet_pk PRIMARY KEY (tweet_id, tweet_time);
+ALTER TABLE public.tweet ADD CONSTRAINT tweet_fk FOREIGN KEY (username) REFERENCES public.twitter_user(username) ON DELETE CASCADE ON UPDATE CASCADE;
+ALTER TABLE public.tweet ADD CONSTRAINT tweet_fk_task FOREIGN KEY (crawler_task) REFERENCES public.program_task(id);
+
+ALTER TABLE public.tweet_token ADD CONSTRAINT tweet_token_pk PRIMARY KEY (tweet_id, token_id, tweet_time);
+ALTER TABLE public.tweet_token ADD CONSTRAINT tweet_token_fk FOREIGN KEY (tweet_id, tweet_time) REFERENCES public.tweet(tweet_id, tweet_time) ON DELETE CASCADE ON UPDATE CASCADE;
+ALTER TABLE public.tweet_token ADD CONSTRAINT tweet_token_token_fk FOREIGN KEY (token_id) REFERENCES public."token"(id);
+
+-- indexes of r11, r13 and r14, they are created on every partition
+CREATE INDEX tweet_username_tweet_time_idx ON public.tweet USING btree (username, tweet_time);
+CREATE INDEX tweet_tweet_time_brin_idx ON public.tweet USING brin (tweet_time);
+CREATE INDEX tweet_tweet_text_fts_idx ON public.tweet USING gin (to_tsvector('simple', tweet_text));
+CREATE INDEX tweet_token_token_id_idx ON public.tweet_token USING btree (token_id, tweet_id);
@@ -0,0 +1,39 @@
+-- summary of tweets of every user, for user api (see i_user_stats).
+-- it is changed when tweets are saved or deleted, and when a crawl job of the user is done
+CREATE TABLE public.twitter_user_stats (
+	username varchar NOT NULL,
+	tweet_count int8 NOT NULL DEFAULT 0,
+	first_tweet_time timestamptz NULL,
+	last_tweet_time timestamptz NULL,
+	last_crawled_at timestamptz NULL,
+	last_task_id int4 NULL,
+	CONSTRAINT twitter_user_stats_pk PRIMARY KEY (username),
+	CONSTRAINT twitter_user_stats_user_fk FOREIGN KEY (username) REFERENCES public.twitter_user(username) ON DELETE CASCADE ON UPDATE CASCADE,
+	CONSTRAINT twitter_user_stats_task_fk FOREIGN KEY (last_task_id) REFERENCES public.program_task(id) ON DELETE SET NULL ON UPDATE CASCADE
+);
+
+INSERT INTO public.twitter_user_stats (username, tweet_count, first_tweet_time, last_tweet_time, last_crawled_at, last_task_id)
+SELECT
+	u.username,
+	coalesce(t.tweet_count, 0),
+	t.first_tweet_time,
+	t.last_tweet_time,
+	j.last_crawled_at,
+	(
+		SELECT lj.task_id FROM public.crawl_job lj
+		WHERE lj.username = u.username and lj.job_status = 'done'
+		ORDER BY lj.finished_at DESC
+		LIMIT 1
+	)
+FROM public.twitter_user u
+LEFT JOIN (
+	SELECT username, count(1) AS tweet_count, min(tweet_time) AS first_tweet_time, max(tweet_time) AS last_tweet_time
+	FROM public.tweet
+	GROUP BY 1
+) t ON t.username = u.username
+LEFT JOIN (
+	SELECT username, max(finished_at) AS last_crawled_at
+	FROM public.crawl_job
+	WHERE job_status = 'done'
+	GROUP BY 1
+) j ON j.username = u.username;
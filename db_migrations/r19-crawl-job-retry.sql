@@ -0,0 +1,3 @@
+-- a failed job is claimed again after 'retry_at', until it has 'crawl-job-max-attempts' attempts
+ALTER TABLE public.crawl_job ADD attempt_count int4 NOT NULL DEFAULT 0;
+ALTER TABLE public.crawl_job ADD retry_at timestamptz NULL;
@@ -1,3 +1,3 @@
-from handlers import chart, dictionary, task, user
+from handlers import chart, dictionary, metrics, search, settings, task, tokens, trends, user
 
 # from handlers import 
@@ -3,8 +3,11 @@ from copy import deepcopy
 from datetime import datetime, timedelta
 from enum import Enum
 
+import numpy as np
+
+import i_chart_cache as chart_cache
 import i_database as db
-from i_main_handler import MainHandler
+from i_main_handler import MainHandler, parse_local_time
 
 Frequency = t.Dict[str, int]
 Frequencies = t.List[Frequency]
@@ -24,20 +27,37 @@ class TimeUnit(Enum):
 
 class ChartHandler(MainHandler):
 
-    #pylint: disable=too-many-locals
+    READ_ONLY_METHODS = ('POST',)
+
     async def post(self):
+        """
+        returns chart of a token, or charts of some tokens.
+        frequencies of all tokens are read by one query.
+
+        input:
+        {
+            "token": str, or "tokens": list of str
+            "since", "until", "chart-type", "time-unit", "usernames",
+            chart parameters: "k-param", "k-s", "k-l", "alpha"
+        }
+
+        returns:
+            for "token": {"data": [{"date", "count"}]}
+            for "tokens": {"data": {token: [{"date", "count"}]}}
+        """
         try:
-            token = self.get_json_arg('token')
-            since = self.get_json_arg('since', datetime.now(), datetime.fromisoformat)
-            until = self.get_json_arg('until', datetime.now() - timedelta(days=10), datetime.fromisoformat)
-        except Exception as e:
-            self.send_error(400, message = str(e))
+            tokens: list = self.get_json_arg('tokens', None)
+            token = None if tokens else self.get_json_arg('token')
+            since = self.get_json_arg('since', datetime.now(), parse_local_time)
+            until = self.get_json_arg('until', datetime.now() - timedelta(days=10), parse_local_time)
 
-        try:
             chart_type = self.get_json_arg('chart-type', ChartType.FREQUENCY, ChartType)
             time_unit = self.get_json_arg('time-unit', TimeUnit.DAY, TimeUnit)
-        except ValueError as e:
+
+            chart_params = self.get_chart_params(chart_type)
+        except Exception as e:
             self.send_error(400, message = str(e))
+            return
 
         usernames: list = self.get_json_arg('usernames', None)
 
@@ -47,137 +67,215 @@ class ChartHandler(MainHandler):
                 "date": x["date"].isoformat()
             }
 
-        if chart_type == ChartType.FREQUENCY:
-            output: list = await get_frequencies(
-                token, time_unit, since, until, usernames, is_zero_filled=False
-            )
-
-        if chart_type == ChartType.MA:
-            try:
-                k_param = self.get_json_arg('k-param', arg_changer_callback=int)
-            except Exception as e:
-                self.send_error(400, message = str(e))
-
-            output = await get_MA(
-                await get_frequencies(token, time_unit, since, until, usernames),
-                k_param
-            )
-
-        if chart_type == ChartType.TREND_MOMENTUM:
-            try:
-                k_s = self.get_json_arg('k-s', arg_changer_callback=int)
-                k_l = self.get_json_arg('k-l', arg_changer_callback=int)
-                alpha = self.get_json_arg('alpha', arg_changer_callback=float)
-            except Exception as e:
-                self.send_error(400, message = str(e))
-
-            output = await get_trend_momentum(
-                await get_frequencies(token, time_unit, since, until, usernames),
-                k_s, k_l,
-                alpha
-            )
-
-        if chart_type == ChartType.MOMENTUM:
-            try:
-                k_s = self.get_json_arg('k-s', arg_changer_callback=int)
-                k_l = self.get_json_arg('k-l', arg_changer_callback=int)
-                alpha = self.get_json_arg('alpha', arg_changer_callback=float)
-                k_param = self.get_json_arg('k-param', arg_changer_callback=int)
-            except Exception as e:
-                self.send_error(400, message = str(e))
-
-            output = await get_MA(
-                await get_trend_momentum(
-                    await get_frequencies(
-                        token, time_unit, since, until, usernames
-                    ), k_s, k_l, alpha
-                ), k_param
-            )
-
-        self.write({
-            "data": list(map(
-                row_json, output
-            ))
-        })
+        series = await get_charts(
+            tokens or [token], chart_type, chart_params, time_unit, since, until, usernames
+        )
+
+        if tokens:
+            self.write({
+                "data": {
+                    series_token: list(map(row_json, output))
+                    for series_token, output in series.items()
+                }
+            })
+        else:
+            self.write({
+                "data": list(map(
+                    row_json, series[token]
+                ))
+            })
+
+    def get_chart_params(self, chart_type: ChartType) -> dict:
+        """
+        reads parameters of chart type from request
+        """
+        params = {}
+
+        if chart_type in (ChartType.MA, ChartType.MOMENTUM):
+            params['k-param'] = self.get_json_arg('k-param', arg_changer_callback=int)
+
+        if chart_type in (ChartType.TREND_MOMENTUM, ChartType.MOMENTUM):
+            params['k-s'] = self.get_json_arg('k-s', arg_changer_callback=int)
+            params['k-l'] = self.get_json_arg('k-l', arg_changer_callback=int)
+            params['alpha'] = self.get_json_arg('alpha', arg_changer_callback=check_alpha)
+
+        return params
+
+class ChartCacheHandler(MainHandler):
+
+    async def get(self):
+        """
+        returns hit/miss counters of chart cache
+        """
+        self.write(chart_cache.get_cache_stats())
+
+
+#: reads frequencies of tokens (hot query)
+__FREQUENCIES_QUERY = '''
+select
+    f."token",
+    date_trunc($1, f.hour_bucket) as "date", -- hour, day
+    sum(f.count)::int8 as "count"
+from token_frequency f
+where
+    f."token" = ANY($2::varchar[])
+    and f.hour_bucket > $3::timestamptz - interval '1 hour'
+    and f.hour_bucket <= $4 {usernames_caluse}
+group by 1, 2;
+'''
+
+FREQUENCIES_QUERY = db.hot_query(
+    'token-frequencies', __FREQUENCIES_QUERY.format(usernames_caluse='')
+)
+
+USERS_FREQUENCIES_QUERY = db.hot_query(
+    'users-token-frequencies',
+    __FREQUENCIES_QUERY.format(usernames_caluse='and f.username = ANY($5::varchar[])')
+)
+
+
+#pylint: disable=too-many-arguments
+async def get_charts(
+    tokens: list,
+    chart_type: ChartType,
+    chart_params: dict,
+    time_unit: TimeUnit,
+    since: datetime,
+    until: datetime,
+    usernames: list
+) -> t.Dict[str, Frequencies]:
+    """
+    returns charts of some tokens, from chart cache or by calculating them.
+
+    returns:
+        token -> chart
+    """
+    charts: t.Dict[str, Frequencies] = {}
+    keys = {}
+
+    for token in dict.fromkeys(tokens):
+        keys[token] = chart_cache.chart_key(
+            token, chart_type, chart_params, time_unit, since, until, usernames
+        )
+        charts[token] = chart_cache.get_chart(keys[token])
+
+    missing_tokens = [token for token, chart in charts.items() if chart is None]
+
+    if missing_tokens:
+        cache_version = chart_cache.get_cache_version()
+
+        calculated = await calculate_charts(
+            missing_tokens, chart_type, chart_params, time_unit, since, until, usernames
+        )
+
+        for token, chart in calculated.items():
+            chart_cache.put_chart(keys[token], chart, cache_version)
+            charts[token] = chart
+
+    return charts
+
+
+#pylint: disable=too-many-arguments
+async def calculate_charts(
+    tokens: list,
+    chart_type: ChartType,
+    chart_params: dict,
+    time_unit: TimeUnit,
+    since: datetime,
+    until: datetime,
+    usernames: list
+) -> t.Dict[str, Frequencies]:
+    """
+    calculates charts of some tokens.
+    zero filled frequencies of all tokens have same dates,
+    so they are calculated together in one array (a row for each token).
+
+    returns:
+        token -> chart
+    """
+    tokens = list(dict.fromkeys(tokens))
+
+    if not tokens:
+        return {}
+
+    if chart_type == ChartType.FREQUENCY:
+        return await get_frequencies_many(
+            tokens, time_unit, since, until, usernames, is_zero_filled=False
+        )
 
-# class ChartSearchHandler(MainHandler):
+    frequencies = await get_frequencies_many(tokens, time_unit, since, until, usernames)
 
-#     async def get(self):
+    counts = np.array(
+        [to_counts(frequencies[token]) for token in tokens], dtype=np.float64
+    ).reshape(len(tokens), -1)
 
-#         token = self.get_json_arg('token')
+    if chart_type == ChartType.MA:
+        values = moving_average(counts, chart_params['k-param'])
 
-#         conn: db.DBConnection
-#         async with await db.get_db_context() as conn:
-#             async with conn.transaction():
+    if chart_type == ChartType.TREND_MOMENTUM:
+        values = trend_momentum(
+            counts, chart_params['k-s'], chart_params['k-l'], chart_params['alpha']
+        )
 
-#                 rows: db.DBRows = await conn.fetch(
-#                     f'''
-#                     select distinct(tt."token") from tweet_token tt where tt."token" like '%{token}%';
-#                     '''
-#                 )
+    if chart_type == ChartType.MOMENTUM:
+        values = moving_average(
+            trend_momentum(
+                counts, chart_params['k-s'], chart_params['k-l'], chart_params['alpha']
+            ),
+            chart_params['k-param']
+        )
 
-#                 self.write({
-#                     "data": list(
-#                         map(lambda x: x.get('token'), rows)
-#                     )
-#                 })
+    return {
+        token: to_frequencies(frequencies[token], values[i])
+        for i, token in enumerate(tokens)
+    }
 
 
 #pylint: disable=too-many-arguments
-async def get_frequencies(
-    token,
+async def get_frequencies_many(
+    tokens: list,
     time_unit: TimeUnit,
     since: datetime,
     until: datetime,
     usernames: list,
     is_zero_filled: bool = True
-) -> Frequencies:
-    usernames_caluse = ''
-    if usernames:
-        _usernames = ' OR '.join(
-            list(map(
-                lambda u: f"t2.username = '{u}'",
-                usernames
-            ))
-        )
+) -> t.Dict[str, Frequencies]:
+    """
+    reads frequencies of some tokens from 'token_frequency' table, by one query.
+    the table has hourly counts, so 'since' is rounded down to its hour.
 
-        usernames_caluse = f' AND ({_usernames})'
+    returns:
+        token -> frequencies
+    """
+    args = [time_unit.value, tokens, since, until]
+
+    query = FREQUENCIES_QUERY
+    if usernames:
+        args.append(usernames)
+        query = USERS_FREQUENCIES_QUERY
 
     conn: db.DBConnection
     async with await db.get_db_context() as conn:
-        async with conn.transaction():
-
-            query = f'''
-            select
-                date_trunc($1, t2.tweet_time) as "date", -- minute, hour, day, week, month, year
-                count(1)
-            from tweet t2
-            join tweet_token tt
-                on t2.tweet_id  = tt.tweet_id
-            where
-                tt."token" = $2
-                and t2.tweet_time >= $3 and t2.tweet_time <= $4 {usernames_caluse}
-            group by 1;
-            '''
-
-            rows: db.DBRows = await conn.fetch(query, time_unit.value, token, since, until)
-
-            frequencies = list(map(
-                #: removing timezone from 'datetime's
-                lambda d: { **d, "date": d["date"].replace(tzinfo=None) },
-                map(
-                    #: conevert to dict
-                    dict,
-                    rows
-                )
-            ))
-
-            sorted_f = sorted(frequencies, key=lambda s: s["date"])
-
-            if is_zero_filled:
-                return zero_filled_frequencies(sorted_f, since, until, time_unit)
-            
-            return sorted_f
+        rows: db.DBRows = await (await conn.hot(query)).fetch(*args)
+
+    frequencies: t.Dict[str, Frequencies] = {token: [] for token in tokens}
+    for row in rows:
+        frequencies[row.get('token')].append({
+            #: removing timezone from 'datetime's
+            "date": row.get('date').replace(tzinfo=None),
+            "count": row.get('count')
+        })
+
+    for token in tokens:
+        sorted_f = sorted(frequencies[token], key=lambda s: s["date"])
+
+        if is_zero_filled:
+            sorted_f = zero_filled_frequencies(sorted_f, since, until, time_unit)
+
+        frequencies[token] = sorted_f
+
+    return frequencies
+
 
 def zero_filled_frequencies(frequencies, since, until, time_unit) -> Frequencies:
     """
@@ -248,74 +346,68 @@ def daterange(since, until, time_unit) -> Frequencies:
                 break
 
 
+def to_counts(frequencies: Frequencies) -> np.ndarray:
+    return np.fromiter(
+        (f['count'] for f in frequencies), dtype=np.float64, count=len(frequencies)
+    )
+
 
-async def get_MA(
-    frequencies,
-    k_param: int
-) -> Frequencies:
+def to_frequencies(frequencies: Frequencies, counts: np.ndarray) -> Frequencies:
     """
-    This function calculates MA time series
+    makes frequencies with dates of 'frequencies' and values of 'counts'
     """
+    return [
+        {"date": f['date'], "count": c} for f, c in zip(frequencies, counts.tolist())
+    ]
 
-    #: calculate MA
-    ma_series = []
-    for n, v in enumerate(frequencies):
-        if n < (k_param - 1):
-            sigma = sum(
-                frequencies[i]['count'] for i in range(0, n+1)
-            )
-            ma_series.append({
-                "date": v['date'],
-                "count": sigma / n if sigma != 0 else 0
-            })
-        else:
-            sigma = sum(
-                frequencies[i]['count'] for i in range(n - k_param + 2, n)
-            )
-            ma_series.append({
-                "date": v['date'],
-                "count": sigma / k_param if sigma != 0 else 0
-            })
 
-    return ma_series
-
-
-async def get_trend_momentum(
-    frequencies,
-    k_s: int,
-    k_l: int,
-    alpha
-) -> Frequencies:
-    trend_momentum = []
-    for n, v in enumerate(frequencies):
-        ma_s = 0
-        ma_l = 0
-
-        if n < (k_s - 1):
-            sigma = sum(
-                frequencies[i]['count'] for i in range(0, n+1)
-            )
-            ma_s = sigma / n if sigma != 0 else 0
-        else:
-            sigma = sum(
-                frequencies[i]['count'] for i in range(n - k_s + 2, n)
-            )
-            ma_s = sigma / k_s if sigma != 0 else 0
-
-        if n < (k_l - 1):
-            sigma = sum(
-                frequencies[i]['count'] for i in range(0, n+1)
-            )
-            ma_l = sigma / n if sigma != 0 else 0
-        else:
-            sigma = sum(
-                frequencies[i]['count'] for i in range(n - k_l + 2, n)
-            )
-            ma_l =  sigma / k_l if sigma != 0 else 0
-
-        trend_momentum.append({
-            'date': v['date'],
-            'count': ma_s - (ma_l ** alpha)
-        })
+def moving_average(counts: np.ndarray, k_param: int) -> np.ndarray:
+    """
+    calculates MA of time series in O(n), by prefix sums.
+    counts: time series in the last axis, so some series can be calculated together.
+
+    for the point 'n':
+        n < k - 1 (warm-up): sum of points 0..n, divided by n (by 1 for first point)
+        otherwise: sum of points (n - k + 2)..(n - 1), divided by k
+    """
+    n_count = counts.shape[-1]
+    n = np.arange(n_count)
+
+    #: prefix_sums[..., i] is sum of counts[..., :i]
+    prefix_sums = np.zeros(counts.shape[:-1] + (n_count + 1,))
+    np.cumsum(counts, axis=-1, out=prefix_sums[..., 1:])
+
+    is_warm_up = n < (k_param - 1)
+
+    window_start = np.clip(n - k_param + 2, 0, n_count)
+    window_sum = np.where(
+        window_start < n,
+        prefix_sums[..., n] - prefix_sums[..., window_start],
+        0
+    )
+
+    sigma = np.where(is_warm_up, prefix_sums[..., n + 1], window_sum)
+    divisor = np.where(is_warm_up, np.maximum(n, 1), k_param)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(sigma != 0, sigma / divisor, 0.0)
+
+
+def check_alpha(value) -> float:
+    """
+    alpha of trend momentum, a negative alpha makes zero moving averages infinite
+    """
+    alpha = float(value)
+
+    if not alpha >= 0:
+        raise ValueError(f'alpha must be a non-negative number: {value}')
+
+    return alpha
+
+
+def trend_momentum(counts: np.ndarray, k_s: int, k_l: int, alpha) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        momentum = moving_average(counts, k_s) - moving_average(counts, k_l) ** alpha
 
-    return trend_momentum
+    #: inf and nan are not valid in json
+    return np.nan_to_num(momentum, nan=0.0, posinf=0.0, neginf=0.0)
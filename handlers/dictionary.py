@@ -1,42 +1,69 @@
 """
 Handler for dictionary api
 """
-import asyncpg
+from typing import Optional
 
+from i_chart_cache import invalidate_tokens
 from i_database import DBConnection, get_db_context
+from i_dictionary import publish_dictionary_change
+from i_jobs import JobProgress, start_job
 from i_main_handler import MainHandler
+from i_pagination import InvalidCursor
+from i_program_settings import get_settings
+from i_task import create_task
+from i_token_frequency import add_tokens, rebuild_tokens_frequencies
+from i_trends import invalidate_trends
 
 
 class DictionaryHandler(MainHandler):
 
+    READ_ONLY_METHODS = ('GET',)
+
     async def get(self):
         """
-        gets some dictionaries
+        gets some dictionaries, ordered by token
 
         query arguments: used for specify returning page
-            start
             count
+            cursor: 'cursor' of previous page, for reading next page
+            export: 'ndjson' -> streams all dictionaries as ndjson
         """
-        start = int(self.get_query_argument('start', 0))
-        count = int(self.get_query_argument('count', 10))
+        try:
+            count = int(self.get_query_argument('count', 10))
+            cursor = self.get_page_cursor()
+            cursor_token = str(cursor[0]) if cursor else None
+        except (InvalidCursor, ValueError, IndexError) as e:
+            self.send_error(400, message = str(e))
+            return
 
         conn: DBConnection
         async with await get_db_context() as conn:
-            async with conn.transaction():
-
-                rows = await conn.fetch(
-                    'SELECT "token", replace_with as "replaceWith" FROM public."dictionary" limit $1 offset $2;', count, start)
-
-                self.write({
-                    "data": list(
-                        map(dict, rows)
-                    )
-                })
+            if self.get_query_argument('export', None) == 'ndjson':
+                await self.write_ndjson(
+                    conn,
+                    'SELECT "token", replace_with as "replaceWith" FROM public."dictionary" order by "token";'
+                )
+                return
+
+            rows = await conn.fetch(
+                f'''
+                SELECT "token", replace_with as "replaceWith" FROM public."dictionary"
+                {'where "token" > $2' if cursor_token else ''}
+                order by "token"
+                limit $1;
+                ''',
+                count + 1,
+                *([cursor_token] if cursor_token else [])
+            )
+
+        self.write_page(
+            rows, count, lambda row: [row.get('token')]
+        )
 
     async def put(self):
         """
         creates a record in 'dictionary' table.
-        also check for all tokens in 'tweet_token' table for this token.
+        also applies it to all tokens in 'tweet_token' table, by a background job.
 
         input:
         {
@@ -46,7 +73,8 @@ class DictionaryHandler(MainHandler):
 
         returns:
         {
-            "token"
+            "token",
+            "task_id": task of the job, its progress is sent on 'task' channel of socket
         }
         """
         token = self.get_json_arg('token')
@@ -62,37 +90,27 @@ class DictionaryHandler(MainHandler):
                     token, replace_with
                 )
 
-        dupError = False
-        conn: DBConnection
-        async with await get_db_context() as conn:
-            async with conn.transaction():
-                if replace_with:
-                    #: replace old tokens with 'replace_with'
-                    try:
-                        await conn.execute(
-                            'update "tweet_token" set "token" = $1 where "token" = $2;',
-                            replace_with, token
-                        )
-                    #: if another token exists in db that is same as replace_with
-                    except asyncpg.exceptions.UniqueViolationError:
-                        dupError = True
-                else:
-                    #: delete tokens if 'replace_with' is null
-                    await conn.execute(
-                        'DELETE FROM public.tweet_token WHERE "token"=$1;',
-                        token
-                    )
-        
-        if dupError:
-            async with await get_db_context() as conn:
-                async with conn.transaction():
-                    await conn.execute(
-                        'DELETE FROM public.tweet_token WHERE "token"=$1;',
-                        token
-                    )
+                token_ids = await add_tokens(
+                    conn,
+                    [token, replace_with] if replace_with else [token]
+                )
+
+        #: new tweets must be analyzed by new dictionary (in crawl workers)
+        await publish_dictionary_change(token, replace_with)
+
+        #: changing saved tweets is done by a background job
+        task_id = await create_task('dictionary-apply', 'not-started', None, None)
+
+        start_job(
+            task_id,
+            lambda report_progress: apply_dictionary_item(
+                token, replace_with, token_ids, report_progress
+            )
+        )
 
         self.write({
-            'token': token_db.get('token')
+            'token': token_db.get('token'),
+            'task_id': task_id
         })
 
     async def delete(self):
@@ -110,6 +128,105 @@ class DictionaryHandler(MainHandler):
                     token
                 )
 
+        await publish_dictionary_change(token, None, removed=True)
+
         self.write({
             "token": token
         })
+
+
+async def apply_dictionary_item(token: str, replace_with: Optional[str], token_ids: dict, report_progress: JobProgress) -> str:
+    """
+    background job of applying a dictionary item to saved tweets
+
+    token_ids: ids of 'token' and 'replace_with' in vocabulary
+    """
+    token_id = token_ids[token]
+    replace_with_id = token_ids[replace_with] if replace_with else None
+
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        all_count = await conn.fetchval(
+            'SELECT total_count FROM public."token" WHERE id = $1;',
+            token_id
+        )
+
+        async def chunk_callback(changed_count):
+            await report_progress(
+                f'applying dictionary, {changed_count} of {all_count} tweets',
+                min(changed_count / all_count * 100, 100) if all_count else 100
+            )
+
+        changed_count = await merge_tweet_tokens(
+            conn,
+            token_id,
+            replace_with_id,
+            get_settings('dictionary-merge-chunk-size'),
+            chunk_callback
+        )
+
+        #: correct frequencies of changed tokens
+        async with conn.transaction():
+            await rebuild_tokens_frequencies(conn, list(token_ids))
+
+    invalidate_trends()
+    invalidate_tokens([token, replace_with])
+
+    return f'dictionary applied to {changed_count} tweets'
+
+
+async def merge_tweet_tokens(
+    conn: DBConnection, token_id: int, replace_with_id: Optional[int], chunk_size: int, chunk_callback = None) -> int:
+    """
+    replaces a token of tweets with another token (or deletes it, if 'replace_with_id' is None).
+    tweets that have both tokens keep one of them.
+
+    rows are changed in chunks, every chunk in its own transaction,
+    so tweets of a common token are not locked until all of them are changed.
+    it ends when no row of the token is left (a chunk can be smaller than chunk_size
+    by concurrent deletes, so it is not the end).
+
+    chunk_callback: it is called with count of changed tweets, after every chunk
+
+    returns:
+        count of changed tweets
+    """
+    all_changed_count = 0
+
+    if token_id == replace_with_id:
+        return all_changed_count
+
+    while True:
+        async with conn.transaction():
+            chunk_result = await conn.fetchrow(
+                '''
+                WITH chunk AS (
+                    SELECT tweet_id, tweet_time FROM public.tweet_token
+                    WHERE token_id = $1
+                    LIMIT $3
+                    FOR UPDATE
+                ), replaced AS (
+                    INSERT INTO public.tweet_token (tweet_id, tweet_time, token_id)
+                    SELECT tweet_id, tweet_time, $2::int4 FROM chunk
+                    WHERE $2::int4 IS NOT NULL
+                    ON CONFLICT DO NOTHING
+                ), deleted AS (
+                    DELETE FROM public.tweet_token tt
+                    USING chunk c
+                    WHERE tt.token_id = $1 and tt.tweet_id = c.tweet_id and tt.tweet_time = c.tweet_time
+                    RETURNING 1
+                )
+                SELECT
+                    (SELECT count(1) FROM chunk) AS chunk_count,
+                    (SELECT count(1) FROM deleted) AS changed_count;
+                ''',
+                token_id, replace_with_id, chunk_size
+            )
+
+        if chunk_result.get('chunk_count') == 0:
+            return all_changed_count
+
+        all_changed_count += chunk_result.get('changed_count')
+
+        if chunk_callback:
+            await chunk_callback(all_changed_count)
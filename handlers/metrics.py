@@ -0,0 +1,15 @@
+"""
+Handler for metrics api
+"""
+from i_main_handler import MainHandler
+from i_metrics import render_metrics
+
+
+class MetricsHandler(MainHandler):
+
+    async def get(self):
+        """
+        returns metrics in prometheus text format
+        """
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(render_metrics())
@@ -0,0 +1,138 @@
+"""
+Handlers for searching tokens and tweets
+"""
+from datetime import datetime
+
+from i_database import DBConnection, DBRow, DBRows, get_db_context
+from i_main_handler import MainHandler
+from i_pagination import InvalidCursor
+
+#: shorter texts are searched as prefix of tokens, longer ones as substring (trigram index)
+TRIGRAM_MIN_LENGTH = 3
+
+
+def escape_like(text: str) -> str:
+    """
+    escapes special characters of 'like' patterns
+    """
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class TokenSearchHandler(MainHandler):
+
+    async def get(self):
+        """
+        autocomplete of tokens: returns tokens that contain the text.
+        tokens that start with the text come first.
+
+        query arguments:
+            q: text
+            count
+        """
+        try:
+            text = self.get_query_argument('q')
+            count = int(self.get_query_argument('count', 10))
+        except Exception as e:
+            self.send_error(400, message = str(e))
+            return
+
+        pattern = escape_like(text)
+
+        if len(text) < TRIGRAM_MIN_LENGTH:
+            query = '''
+            SELECT tk."token" FROM public."token" tk
+            WHERE tk."token" LIKE $1 || '%' AND tk.total_count > 0
+            ORDER BY tk."token"
+            LIMIT $2;
+            '''
+        else:
+            query = '''
+            SELECT tk."token" FROM public."token" tk
+            WHERE tk."token" LIKE '%' || $1 || '%' AND tk.total_count > 0
+            ORDER BY tk."token" LIKE $1 || '%' DESC, length(tk."token"), tk."token"
+            LIMIT $2;
+            '''
+
+        conn: DBConnection
+        async with await get_db_context() as conn:
+            rows: DBRows = await conn.fetch(query, pattern, count)
+
+        self.write({
+            "data": list(
+                map(lambda x: x.get('token'), rows)
+            )
+        })
+
+
+class TweetSearchHandler(MainHandler):
+
+    async def get(self):
+        """
+        full text search of tweets, newest first
+
+        query arguments:
+            q: words that tweets must have
+            username: filters tweets by username, can be repeated
+            since, until: time range
+            count
+            cursor: 'cursor' of previous page, for reading next page
+        """
+        try:
+            text = self.get_query_argument('q')
+            count = int(self.get_query_argument('count', 10))
+            since = self.get_query_argument('since', None)
+            since = datetime.fromisoformat(since) if since else None
+            until = self.get_query_argument('until', None)
+            until = datetime.fromisoformat(until) if until else None
+
+            cursor = self.get_page_cursor()
+            if cursor:
+                cursor = [datetime.fromisoformat(cursor[0]), int(cursor[1])]
+        except (InvalidCursor, ValueError, TypeError, IndexError) as e:
+            self.send_error(400, message = str(e))
+            return
+
+        usernames = self.get_query_arguments('username')
+
+        args = [text, count + 1]
+        where_clauses = ["to_tsvector('simple', t.tweet_text) @@ plainto_tsquery('simple', $1)"]
+
+        def add_clause(clause: str, *values):
+            for value in values:
+                args.append(value)
+            where_clauses.append(clause.format(*range(len(args) - len(values) + 1, len(args) + 1)))
+
+        if usernames:
+            add_clause('t.username = ANY(${}::varchar[])', usernames)
+        if since:
+            add_clause('t.tweet_time >= ${}', since)
+        if until:
+            add_clause('t.tweet_time <= ${}', until)
+        if cursor:
+            add_clause('(t.tweet_time, t.tweet_id) < (${}, ${})', *cursor)
+
+        def row_to_json(row: DBRow):
+            return {
+                **dict(row),
+                "tweet_time": row.get('tweet_time').isoformat()
+            }
+
+        conn: DBConnection
+        async with await get_db_context() as conn:
+            rows: DBRows = await conn.fetch(
+                f'''
+                SELECT t.tweet_id, t.tweet_text, t.username, t.tweet_time
+                FROM public.tweet t
+                WHERE {' AND '.join(where_clauses)}
+                ORDER BY t.tweet_time DESC, t.tweet_id DESC
+                LIMIT $2;
+                ''',
+                *args
+            )
+
+        self.write_page(
+            rows,
+            count,
+            lambda row: [row.get('tweet_time'), row.get('tweet_id')],
+            row_to_json
+        )
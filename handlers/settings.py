@@ -0,0 +1,26 @@
+"""
+Handler for program settings api
+"""
+from i_main_handler import MainHandler
+from i_program_settings import get_all_settings, reload_settings
+
+
+class SettingsHandler(MainHandler):
+
+    async def get(self):
+        """
+        returns current program settings
+        """
+        self.write(dict(get_all_settings()))
+
+    async def post(self):
+        """
+        reads settings file again, without waiting for its change to be detected
+        """
+        try:
+            settings = reload_settings()
+        except (OSError, ValueError) as e:
+            self.send_error(400, message = str(e))
+            return
+
+        self.write(dict(settings))
@@ -2,41 +2,83 @@ from datetime import datetime
 
 from i_database import DBConnection, DBRow, DBRows, get_db_context
 from i_main_handler import MainHandler
+from i_pagination import InvalidCursor
+
+TASK_COLUMNS = 'id, task_user, task_type, task_state, task_status, created_at, crawl_since, crawl_until'
 
 
 class TaskHandler(MainHandler):
 
+    READ_ONLY_METHODS = ('GET',)
+
     async def get(self):
+        """
+        gets some tasks, ordered by 'crawl_until' (newest first)
+
+        query arguments:
+            count
+            cursor: 'cursor' of previous page, for reading next page
+            export: 'ndjson' -> streams all tasks as ndjson
+        """
+        try:
+            count = int(self.get_query_argument('count', 10))
+            cursor = self.get_page_cursor()
+            cursor_until = datetime.fromisoformat(cursor[0]) if cursor and cursor[0] else None
+            cursor_id = int(cursor[1]) if cursor else None
+        except (InvalidCursor, ValueError, TypeError, IndexError) as e:
+            self.send_error(400, message = str(e))
+            return
+
+        def row_to_json(row: DBRow):
+            row_dict = dict(row)
+
+            for k in row_dict:
+                if isinstance(row_dict[k], datetime):
+                    d: datetime = row_dict[k]
+                    row_dict[k] = d.isoformat()
 
-        start = int(self.get_query_argument('start', 0))
-        count = int(self.get_query_argument('count', 10))
+            return row_dict
 
         conn: DBConnection
         async with await get_db_context() as conn:
-            async with conn.transaction():
-                rows: DBRows = await conn.fetch(
-                    """
-                    SELECT 
-                        id, task_user, task_type, task_state, created_at, crawl_since, crawl_until
+            if self.get_query_argument('export', None) == 'ndjson':
+                await self.write_ndjson(
+                    conn,
+                    f"""
+                    SELECT {TASK_COLUMNS}
                     FROM public.program_task
-                    order by crawl_until desc
-                    limit $1 offset $2;
+                    order by crawl_until desc, id desc;
                     """,
-                    count, start
+                    row_to_json=row_to_json
                 )
+                return
 
-                def row_to_json(row: DBRow):
-                    row_dict = dict(row)
+            args = [count + 1]
 
-                    for k in row_dict:
-                        if isinstance(row_dict[k], datetime):
-                            d: datetime = row_dict[k]
-                            row_dict[k] = d.isoformat()
+            #: tasks without 'crawl_until' are first (desc order)
+            if cursor is None:
+                after_cursor_clause = ''
+            elif cursor_until is None:
+                args.append(cursor_id)
+                after_cursor_clause = 'where (crawl_until is null and id < $2) or crawl_until is not null'
+            else:
+                args.extend([cursor_until, cursor_id])
+                after_cursor_clause = 'where (crawl_until, id) < ($2, $3)'
 
-                    return row_dict
+            rows: DBRows = await conn.fetch(
+                f"""
+                SELECT {TASK_COLUMNS}
+                FROM public.program_task
+                {after_cursor_clause}
+                order by crawl_until desc, id desc
+                limit $1;
+                """,
+                *args
+            )
 
-                self.write({
-                    "data": list(
-                        map(row_to_json, rows)
-                    )
-                })
+        self.write_page(
+            rows,
+            count,
+            lambda row: [row.get('crawl_until'), row.get('id')],
+            row_to_json
+        )
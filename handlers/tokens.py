@@ -0,0 +1,65 @@
+"""
+Handler for token explorer api
+"""
+from i_database import DBConnection, DBRow, DBRows, get_db_context
+from i_main_handler import MainHandler
+from i_pagination import InvalidCursor
+
+
+class TokenHandler(MainHandler):
+
+    async def get(self):
+        """
+        gets some tokens with their count in all tweets, most frequent first
+
+        query arguments:
+            count
+            cursor: 'cursor' of previous page, for reading next page
+            export: 'ndjson' -> streams all tokens as ndjson
+        """
+        try:
+            count = int(self.get_query_argument('count', 10))
+            cursor = self.get_page_cursor()
+            cursor_count = int(cursor[0]) if cursor else None
+            cursor_id = int(cursor[1]) if cursor else None
+        except (InvalidCursor, ValueError, TypeError, IndexError) as e:
+            self.send_error(400, message = str(e))
+            return
+
+        def row_to_json(row: DBRow):
+            return {
+                "token": row.get('token'),
+                "count": row.get('total_count')
+            }
+
+        conn: DBConnection
+        async with await get_db_context() as conn:
+            if self.get_query_argument('export', None) == 'ndjson':
+                await self.write_ndjson(
+                    conn,
+                    '''
+                    SELECT id, "token", total_count FROM public."token"
+                    where total_count > 0
+                    order by total_count desc, id desc;
+                    ''',
+                    row_to_json=row_to_json
+                )
+                return
+
+            rows: DBRows = await conn.fetch(
+                f'''
+                SELECT id, "token", total_count FROM public."token"
+                where total_count > 0 {'and (total_count, id) < ($2, $3)' if cursor else ''}
+                order by total_count desc, id desc
+                limit $1;
+                ''',
+                count + 1,
+                *([cursor_count, cursor_id] if cursor else [])
+            )
+
+        self.write_page(
+            rows,
+            count,
+            lambda row: [row.get('total_count'), row.get('id')],
+            row_to_json
+        )
@@ -0,0 +1,94 @@
+"""
+Handler for trends api
+"""
+import heapq
+from datetime import datetime, timedelta
+from enum import Enum
+
+from handlers.chart import ChartType, TimeUnit, check_alpha, get_charts
+from i_main_handler import MainHandler, parse_local_time
+from i_trends import get_top_tokens
+
+
+#: how tokens are ordered
+class TrendScore(Enum):
+    FREQUENCY = 'frequency'
+    TREND_MOMENTUM = 'trend-momentum'
+
+
+#: for 'trend-momentum', this number of most frequent tokens are scored
+MOMENTUM_CANDIDATES_FACTOR = 5
+
+
+class TrendsHandler(MainHandler):
+
+    async def get(self):
+        """
+        returns the trends: most frequent tokens, or tokens with most trend momentum
+
+        query arguments:
+            count: count of tokens
+            since, until: time range, last day by default
+            username: filters tweets by username, can be repeated
+            score: 'frequency' (default) or 'trend-momentum'
+            for 'trend-momentum':
+                time-unit, k-s, k-l, alpha: parameters of trend momentum chart
+
+        returns:
+        {
+            "data": [{"token", "count", "score"?}]
+        }
+        """
+        try:
+            count = int(self.get_query_argument('count', 10))
+            until = parse_local_time(
+                self.get_query_argument('until', datetime.now().isoformat())
+            )
+            since = parse_local_time(
+                self.get_query_argument('since', (until - timedelta(days=1)).isoformat())
+            )
+            score = TrendScore(self.get_query_argument('score', TrendScore.FREQUENCY.value))
+
+            if score == TrendScore.TREND_MOMENTUM:
+                time_unit = TimeUnit(self.get_query_argument('time-unit', TimeUnit.HOUR.value))
+                chart_params = {
+                    "k-s": int(self.get_query_argument('k-s')),
+                    "k-l": int(self.get_query_argument('k-l')),
+                    "alpha": check_alpha(self.get_query_argument('alpha'))
+                }
+        except Exception as e:
+            self.send_error(400, message = str(e))
+            return
+
+        usernames = self.get_query_arguments('username') or None
+
+        if score == TrendScore.FREQUENCY:
+            top_tokens = await get_top_tokens(count, since, until, usernames)
+
+            self.write({
+                "data": [
+                    {"token": token, "count": frequency} for token, frequency in top_tokens
+                ]
+            })
+            return
+
+        #: scores most frequent tokens by their last trend momentum
+        candidates = dict(await get_top_tokens(
+            count * MOMENTUM_CANDIDATES_FACTOR, since, until, usernames
+        ))
+
+        charts = await get_charts(
+            list(candidates), ChartType.TREND_MOMENTUM, chart_params,
+            time_unit, since, until, usernames
+        )
+
+        scores = [
+            (token, chart[-1]['count'] if chart else 0) for token, chart in charts.items()
+        ]
+
+        self.write({
+            "data": [
+                {"token": token, "count": candidates[token], "score": token_score}
+                for token, token_score in heapq.nlargest(count, scores, key=lambda x: x[1])
+            ]
+        })
@@ -1,61 +1,103 @@
-import asyncio
 from datetime import datetime
 from typing import List
 
-from crawl_analyze.crawl import crawl_user
-from i_database import DBConnection, DBRow, get_db_context
+from crawl_analyze.crawl_queue import create_crawl_task
+from i_chart_cache import invalidate_username
+from i_database import DBConnection, DBRow, DBRows, get_db_context
+from i_jobs import JobProgress, start_job
 from i_main_handler import MainHandler
+from i_pagination import InvalidCursor
+from i_program_settings import get_settings
 from i_task import create_task
+from i_token_frequency import remove_tweets_frequencies
+from i_trends import invalidate_trends
+from i_user_stats import remove_tweets_stats
+
+#: users with their stats (twitter_user_stats)
+USER_STATS_QUERY = '''
+select
+    u.username,
+    u.iscrawl,
+    coalesce(s.tweet_count, 0) as "count",
+    s.first_tweet_time as "from",
+    s.last_tweet_time as "to",
+    s.last_crawled_at as "last-crawled-at",
+    s.last_task_id as "last-task-id"
+from twitter_user u
+left join twitter_user_stats s on s.username = u.username
+'''
 
 
 class UserHandler(MainHandler):
 
+    READ_ONLY_METHODS = ('GET',)
+
     async def get(self):
+        """
+        gets tweets info of a user, or a page of users ordered by username (with tweets info of them)
 
-        count = int(self.get_query_argument('count', 10))
-        start = int(self.get_query_argument('start', 0))
+        query arguments:
+            username: for info of a user
+            count
+            cursor: 'cursor' of previous page, for reading next page
+            export: 'ndjson' -> streams all users as ndjson
+        """
+        try:
+            count = int(self.get_query_argument('count', 10))
+            cursor = self.get_page_cursor()
+            cursor_username = str(cursor[0]) if cursor else None
+        except (InvalidCursor, ValueError, IndexError) as e:
+            self.send_error(400, message = str(e))
+            return
 
         username = self.get_query_argument('username', None)
 
-        conn: DBConnection
-        async with await get_db_context() as conn:
-            async with conn.transaction():
+        def row_to_json(row: DBRow):
+            row_dict = dict(row)
 
-                if username:
-                    firs_last = await conn.fetchrow(
-                        """
-                        select min(t.tweet_time) as "from", max(t.tweet_time) as "to" from tweet t
-                        inner join twitter_user on t.username = twitter_user.username
-                        where t.username = $1;
-                        """,
-                        username
-                    )
+            for k in ('from', 'to', 'last-crawled-at'):
+                if row_dict[k] is not None:
+                    row_dict[k] = row_dict[k].isoformat()
 
-                    firs_last_d = {
-                        "from": str(firs_last.get('to')),
-                        "to": str(firs_last.get('to'))
-                    }
+            return row_dict
 
-                    count = await conn.fetchrow(
-                        "select count(t.tweet_id) from tweet t where username = $1;",
-                        username
-                    )
+        conn: DBConnection
+        async with await get_db_context() as conn:
+            if not username and self.get_query_argument('export', None) == 'ndjson':
+                await self.write_ndjson(
+                    conn,
+                    f"{USER_STATS_QUERY} order by u.username;",
+                    row_to_json=row_to_json
+                )
+                return
 
-                    self.write({
-                        "username": username,
-                        **dict(firs_last_d),
-                        **dict(count)
-                    })
+            if username:
+                row: DBRow = await conn.fetchrow(
+                    f"{USER_STATS_QUERY} where u.username = $1;",
+                    username
+                )
 
-                else:
-                    rows: List[DBRow] = await conn.fetch(
-                        "select username, iscrawl from twitter_user limit $1 offset $2", count, start)
+                if row is None:
+                    self.send_error(404, message = f'user not found: {username}')
+                    return
+
+                self.write(row_to_json(row))
+
+            else:
+                rows: List[DBRow] = await conn.fetch(
+                    f"""
+                    {USER_STATS_QUERY}
+                    {'where u.username > $2' if cursor_username else ''}
+                    order by u.username
+                    limit $1;
+                    """,
+                    count + 1,
+                    *([cursor_username] if cursor_username else [])
+                )
 
-                    self.write({
-                        "data": list(
-                            map(dict, rows)
-                        )
-                    })
+                self.write_page(
+                    rows, count, lambda row: [row.get('username')], row_to_json
+                )
 
     async def put(self):
 
@@ -74,6 +116,10 @@ class UserHandler(MainHandler):
                 })
 
     async def delete(self):
+        """
+        deletes a user, or tweets of user (if "delete-tweets" specified).
+        tweets are deleted by a background job, its "task_id" is returned.
+        """
 
         username = self.get_json_arg('username')
 
@@ -82,32 +128,46 @@ class UserHandler(MainHandler):
             tweet_delete_start = datetime.fromisoformat(delete_tweets['start'])
             tweet_delete_end = datetime.fromisoformat(delete_tweets['end'])
 
+            task_id = await create_task(
+                'tweets-delete',
+                'not-started',
+                tweet_delete_start,
+                tweet_delete_end,
+                username
+            )
+
+            self.write({
+                "username": username,
+                "task_id": task_id
+            })
+
+            start_job(
+                task_id,
+                lambda report_progress: delete_user_tweets(
+                    username, tweet_delete_start, tweet_delete_end, report_progress
+                )
+            )
+            return
+
         conn: DBConnection
         async with await get_db_context() as conn:
             async with conn.transaction():
-                if delete_tweets:
-                    await conn.execute(
-                        """
-                        delete from public.tweet t
-                        where
-                            t.tweet_time >= $1 and
-                            t.tweet_time <= $2 and
-                            t.username = $3;
-                        """,
-                        tweet_delete_start,
-                        tweet_delete_end,
-                        username
-                    )
-                else:
-                    await conn.execute(
-                        "DELETE FROM public.twitter_user WHERE username=$1;",
-                        username
-                    )
+                #: keeps 'total_count' of tokens correct
+                await remove_tweets_frequencies(conn, username)
+
+                await conn.execute(
+                    "DELETE FROM public.twitter_user WHERE username=$1;",
+                    username
+                )
 
                 self.write({
                     "username": username
                 })
 
+        #: frequencies of user are changed
+        invalidate_trends()
+        invalidate_username(username)
+
     async def patch(self):
 
         username = self.get_json_arg('username')
@@ -127,19 +187,20 @@ class UserHandler(MainHandler):
 
     async def post(self):
         """
-        This method is used for crawling a user
+        This method is used for crawling a user.
+        The crawl is added to crawl queue, its task id is returned.
         """
 
         username = self.get_json_arg('username')
         crawl_since = self.get_json_arg('crawl-since')
         crawl_until = self.get_json_arg('crawl-until')
 
-        #: create crawl task in db
-        task_id = await create_task(
+        #: create crawl task and its jobs in db
+        task_id = await create_crawl_task(
             'user-crawl',
-            'not-crawled',
             datetime.fromisoformat(crawl_since),
             datetime.fromisoformat(crawl_until),
+            [username],
             username
         )
 
@@ -149,12 +210,73 @@ class UserHandler(MainHandler):
         })
 
 
-        # : create a 'async task' (not or task) for crawling user
-        asyncio.create_task(
-            crawl_user(
-                username,
-                task_id,
-                crawl_since,
-                crawl_until
-            )
+async def delete_user_tweets(username, start: datetime, end: datetime, report_progress: JobProgress) -> str:
+    """
+    background job of deleting tweets of a user in a time range.
+    tweets are deleted in chunks, every chunk in its own transaction.
+    """
+    chunk_size = get_settings('tweet-delete-chunk-size')
+
+    deleted_count = 0
+
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        all_count = await conn.fetchval(
+            """
+            select count(1) from public.tweet t
+            where
+                t.tweet_time >= $1 and
+                t.tweet_time <= $2 and
+                t.username = $3;
+            """,
+            start, end, username
         )
+
+        while True:
+            async with conn.transaction():
+                rows: DBRows = await conn.fetch(
+                    """
+                    select t.tweet_id from public.tweet t
+                    where
+                        t.tweet_time >= $1 and
+                        t.tweet_time <= $2 and
+                        t.username = $3
+                    limit $4
+                    for update;
+                    """,
+                    start, end, username, chunk_size
+                )
+                tweet_ids = [row.get('tweet_id') for row in rows]
+
+                if tweet_ids:
+                    await remove_tweets_frequencies(conn, username, tweet_ids)
+
+                    #: the time range limits the delete to partitions of the range
+                    await conn.execute(
+                        """
+                        delete from public.tweet
+                        where
+                            tweet_id = ANY($1::int8[]) and
+                            tweet_time >= $2 and
+                            tweet_time <= $3;
+                        """,
+                        tweet_ids, start, end
+                    )
+
+                    await remove_tweets_stats(conn, {username: len(tweet_ids)})
+
+            deleted_count += len(tweet_ids)
+
+            await report_progress(
+                f'deleting tweets, {deleted_count} of {all_count}',
+                min(deleted_count / all_count * 100, 100) if all_count else 100
+            )
+
+            if len(tweet_ids) < chunk_size:
+                break
+
+    #: frequencies of user are changed
+    invalidate_trends()
+    invalidate_username(username)
+
+    return f'{deleted_count} tweets deleted'
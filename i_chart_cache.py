@@ -0,0 +1,169 @@
+"""
+This module caches calculated charts, one entry for every token.
+
+Entries are removed:
+    - after 'chart-cache-ttl-second' (program settings), or 'chart-cache-replica-ttl-second'
+      for charts calculated on a read replica (it can be behind the invalidations)
+    - when the cache has more than 'chart-cache-size' entries (least recently used)
+    - when tweets of a user are crawled or deleted (entries of all users, or of that user);
+      for crawled tweets, only entries that their time range has the crawled hours
+    - when a token is changed by dictionary
+
+A chart that is calculated while an invalidation happens is not cached, if the invalidation removes its key.
+"""
+
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Callable, Hashable, Iterable, Optional, Tuple
+
+from i_database import is_read_replica
+from i_metrics import Gauge
+from i_program_settings import get_all_settings
+
+ChartKey = Tuple[Hashable, ...]
+
+#: key -> (expire time, chart)
+__cache: OrderedDict = OrderedDict()
+
+#: increases on every invalidation
+__version = 0
+
+#: recent invalidations, as (version, is_invalid), charts calculated before them are checked by them
+__invalidations: deque = deque(maxlen=1000)
+
+__stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "invalidations": 0
+}
+
+
+def chart_key(token, chart_type, chart_params: dict, time_unit, since, until, usernames) -> ChartKey:
+    """
+    normalized key of a chart request
+    """
+    return (
+        token,
+        chart_type.value,
+        tuple(sorted(chart_params.items())),
+        time_unit.value,
+        since,
+        until,
+        tuple(sorted(set(usernames))) if usernames else None
+    )
+
+
+def get_chart(key: ChartKey):
+    """
+    returns cached chart, or None
+    """
+    entry = __cache.get(key)
+
+    if entry is None or entry[0] < time.monotonic():
+        if entry is not None:
+            del __cache[key]
+
+        __stats["misses"] += 1
+        return None
+
+    __cache.move_to_end(key)
+    __stats["hits"] += 1
+
+    return entry[1]
+
+
+def get_cache_version() -> int:
+    """
+    must be read before calculating a chart, and passed to 'put_chart'
+    """
+    return __version
+
+
+def put_chart(key: ChartKey, chart, version: int):
+    """
+    caches a chart, if it is not invalidated since 'version'
+    """
+    if version != __version:
+        #: older invalidations are forgotten, so it may be invalid
+        if not __invalidations or __invalidations[0][0] > version + 1:
+            return
+
+        if any(v > version and is_invalid(key) for v, is_invalid in __invalidations):
+            return
+
+    settings = get_all_settings()
+
+    #: it must be called in the request that calculated the chart
+    ttl_second = settings['chart-cache-replica-ttl-second' if is_read_replica() else 'chart-cache-ttl-second']
+
+    __cache[key] = (time.monotonic() + ttl_second, chart)
+    __cache.move_to_end(key)
+
+    while len(__cache) > settings['chart-cache-size']:
+        __cache.popitem(last=False)
+        __stats["evictions"] += 1
+
+
+def invalidate_username(username: str):
+    """
+    removes charts that can contain tweets of the user
+    """
+    __invalidate(
+        lambda key: key[6] is None or username in key[6]
+    )
+
+
+def invalidate_tweet_hours(usernames: Iterable[str], first_hour: datetime, last_hour: datetime):
+    """
+    removes charts that can contain tweets of the users, in hour buckets from 'first_hour' to 'last_hour'.
+    it is used after crawl workers save tweets.
+    """
+    usernames = set(usernames)
+
+    #: times of charts are naive local times
+    since = first_hour.astimezone().replace(tzinfo=None)
+    until = last_hour.astimezone().replace(tzinfo=None) + timedelta(hours=1)
+
+    __invalidate(
+        lambda key: (key[6] is None or not usernames.isdisjoint(key[6])) and key[4] < until and key[5] >= since
+    )
+
+
+def invalidate_tokens(tokens: Iterable[Optional[str]]):
+    """
+    removes charts of the tokens
+    """
+    tokens = set(tokens)
+
+    __invalidate(
+        lambda key: key[0] in tokens
+    )
+
+
+def get_cache_stats() -> dict:
+    return {
+        **__stats,
+        "size": len(__cache)
+    }
+
+
+def __invalidate(is_invalid: Callable[[ChartKey], bool]):
+    global __version
+
+    __version += 1
+    __stats["invalidations"] += 1
+
+    __invalidations.append((__version, is_invalid))
+
+    for key in [key for key in __cache if is_invalid(key)]:
+        del __cache[key]
+
+
+Gauge(
+    'chart_cache',
+    'chart cache counters and size',
+    lambda: {(k,): v for k, v in get_cache_stats().items()},
+    ('stat',)
+)
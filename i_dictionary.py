@@ -0,0 +1,144 @@
+"""
+This module keeps an in-memory copy of 'dictionary' table.
+Crawler uses it for replacing or removing tokens, without querying db for every token.
+
+The api server publishes a 'dictionary-changed' event for every change of the table (see i_events),
+and crawl workers change their copy by it.
+"""
+
+import asyncio
+from typing import Dict, List, Optional
+
+from i_database import DBConnection, DBRows, get_db_context
+from i_events import EVENTS_CONNECTED, publish_event, subscribe_event
+
+#: token -> replace_with (None means the token must not be saved)
+__dictionary: Dict[str, Optional[str]] = None
+
+#: increases on every change of the dictionary
+__version = 0
+
+__load_lock = asyncio.Lock()
+
+
+async def get_dictionary() -> Dict[str, Optional[str]]:
+    """
+    returns the dictionary, loads it from db at first call
+    """
+
+    if __dictionary is None:
+        async with __load_lock:
+            if __dictionary is None:
+                await __load_dictionary()
+
+    return __dictionary
+
+
+async def publish_dictionary_change(token: str, replace_with: Optional[str], removed: bool = False):
+    """
+    sends a change of 'dictionary' table to all processes, after it is committed
+    """
+    await publish_event(
+        'dictionary-changed',
+        {'token': token, 'replace-with': replace_with, 'removed': removed}
+    )
+
+
+def subscribe_dictionary_events():
+    """
+    keeps the in-memory dictionary of this process updated by 'dictionary-changed' events.
+    'listen_events' of i_events must run too.
+    """
+    subscribe_event('dictionary-changed', __on_dictionary_changed)
+
+    #: changes may be missed while listener was disconnected
+    subscribe_event(EVENTS_CONNECTED, lambda data: invalidate_dictionary())
+
+
+def invalidate_dictionary():
+    """
+    the dictionary will be read from db again, at next call
+    """
+    global __dictionary, __version
+
+    __dictionary = None
+    __version += 1
+
+
+def set_dictionary_item(token: str, replace_with: Optional[str]):
+    """
+    updates the in-memory dictionary after a record is inserted in db
+    """
+    global __version
+
+    if __dictionary is not None:
+        __dictionary[token] = replace_with
+
+    __version += 1
+
+
+def remove_dictionary_item(token: str):
+    """
+    updates the in-memory dictionary after a record is deleted from db
+    """
+    global __version
+
+    if __dictionary is not None:
+        __dictionary.pop(token, None)
+
+    __version += 1
+
+
+def apply_dictionary(dictionary: Dict[str, Optional[str]], tokens: list) -> List[str]:
+    """
+    replaces tokens by the dictionary and removes tokens that must not be saved.
+    the result has no duplicates.
+    """
+    result = []
+    seen = set()
+
+    for token in tokens:
+        if token in dictionary:
+            token = dictionary[token]
+
+            #: it shouldn't be saved
+            if not token:
+                continue
+
+        if token not in seen:
+            seen.add(token)
+            result.append(token)
+
+    return result
+
+
+def __on_dictionary_changed(data: dict):
+    if data.get('removed'):
+        remove_dictionary_item(data.get('token'))
+    else:
+        set_dictionary_item(data.get('token'), data.get('replace-with'))
+
+
+async def __load_dictionary():
+    """
+    reads all of 'dictionary' table.
+    if dictionary changes while reading, it reads again.
+    """
+    global __dictionary, __version
+
+    while True:
+        version = __version
+
+        conn: DBConnection
+        async with await get_db_context() as conn:
+            rows: DBRows = await conn.fetch(
+                'SELECT "token", replace_with FROM public."dictionary";'
+            )
+
+        if version == __version:
+            break
+
+    __dictionary = {
+        row.get('token'): row.get('replace_with') for row in rows
+    }
+    __version += 1
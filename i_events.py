@@ -0,0 +1,98 @@
+"""
+This module passes events between processes (api server and crawl workers),
+by NOTIFY and LISTEN of postgres.
+
+Events are json: {"type": str, "data": dict}.
+A notification of postgres is at most 8000 bytes, so data of events must be small.
+
+Events are not received while the listener is disconnected, so after every connection
+an 'events-connected' event is passed to subscribers of this process (it is not published),
+then they can read again what they keep from events.
+"""
+
+import asyncio
+import json
+from typing import Callable, Dict, List
+
+from i_database import DBConnection, connect_db, get_db_context
+
+EVENTS_CHANNEL = 'program_events'
+
+#: local event of this process, after the listener is connected
+EVENTS_CONNECTED = 'events-connected'
+
+#: when connection of listener is lost, it is opened again after this time
+LISTEN_RETRY_SECOND = 5
+
+#: event type -> functions that are called with data of event
+__subscribers: Dict[str, List[Callable]] = {}
+
+
+async def publish_event(event_type: str, data: dict):
+    """
+    sends an event to all listening processes (also this process, if it listens)
+    """
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        await conn.execute(
+            'SELECT pg_notify($1, $2);',
+            EVENTS_CHANNEL,
+            json.dumps({"type": event_type, "data": data})
+        )
+
+
+def subscribe_event(event_type: str, callback: Callable):
+    """
+    'callback' is called with data of every event of the type.
+    it can be a function or a coroutine function.
+    """
+    __subscribers.setdefault(event_type, []).append(callback)
+
+
+async def listen_events():
+    """
+    listens to events of all processes, and calls subscribers.
+    it runs forever, and connects again if db connection is lost.
+    """
+    while True:
+        conn: DBConnection = None
+        try:
+            conn = await connect_db()
+
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _: lost.set())
+            await conn.add_listener(EVENTS_CHANNEL, __on_notification)
+
+            print('[events][listening]')
+            __dispatch(EVENTS_CONNECTED, {})
+
+            await lost.wait()
+        except Exception as e:
+            print(f'[events][error][{e}]')
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+
+        await asyncio.sleep(LISTEN_RETRY_SECOND)
+
+
+def __on_notification(conn, pid, channel, payload):
+    try:
+        event = json.loads(payload)
+    except ValueError as e:
+        print(f'[events][invalid event][{e}]')
+        return
+
+    __dispatch(event['type'], event['data'])
+
+
+def __dispatch(event_type: str, data: dict):
+    #: an error of a subscriber doesn't stop others
+    for callback in __subscribers.get(event_type, []):
+        try:
+            result = callback(data)
+
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
+        except Exception as e:
+            print(f'[events][{event_type}][subscriber error][{e}]')
@@ -0,0 +1,87 @@
+"""
+This module runs background jobs: long db operations that must not run inside an http request.
+Every job has a task in 'program_task' (like crawls), its progress is sent on 'task' channel of socket.io
+(by i_progress, like progress of crawl workers).
+
+Jobs run in the api server process, they are not resumed after a restart:
+their tasks that are not finished are marked as failed at startup ('fail_orphaned_jobs').
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Set
+
+from i_database import DBConnection, get_db_context
+from i_progress import report_progress
+from i_task import change_task_state
+
+#: task types of jobs
+JOB_TASK_TYPES = ('dictionary-apply', 'tweets-delete')
+
+#: a job reports its progress by this callback: (state, percent)
+JobProgress = Callable[[str, float], Awaitable[None]]
+
+#: a job gets the progress callback, and returns its final state
+Job = Callable[[JobProgress], Awaitable[str]]
+
+#: running jobs, the event loop keeps only weak references to tasks
+__running_jobs: Set[asyncio.Task] = set()
+
+
+def start_job(task_id, job: Job) -> asyncio.Task:
+    """
+    runs a job in background, the task of job must be created before
+    """
+    job_task = asyncio.create_task(__run_job(task_id, job))
+
+    __running_jobs.add(job_task)
+    job_task.add_done_callback(__running_jobs.discard)
+
+    return job_task
+
+
+async def fail_orphaned_jobs() -> int:
+    """
+    marks tasks of jobs that were not finished before a restart as failed.
+    it must be called at startup of api server, before starting any job.
+
+    returns:
+        count of failed tasks
+    """
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        result: str = await conn.execute(
+            '''
+            UPDATE public.program_task
+            SET task_status = 'failed', task_state = 'failed: stopped by restart'
+            WHERE task_type = ANY($1::varchar[]) and task_status IN ('pending', 'running');
+            ''',
+            list(JOB_TASK_TYPES)
+        )
+
+    #: 'UPDATE <count>'
+    return int(result.split()[-1])
+
+
+async def __run_job(task_id, job: Job):
+
+    async def report_job_progress(state: str, percent: float):
+        await change_task_state(task_id, state)
+
+        await report_progress(task_id, state, percent)
+
+    print(f'[job][task:{task_id}][start]')
+    await change_task_state(task_id, 'started', 'running')
+
+    try:
+        state = await job(report_job_progress)
+        status = 'done'
+    except Exception as e:
+        print(f'[job][task:{task_id}][error][{e}]')
+        state = f'failed: {e}'
+        status = 'failed'
+
+    print(f'[job][task:{task_id}][{state}]')
+
+    await change_task_state(task_id, state, status)
+
+    await report_progress(task_id, state, final=True)
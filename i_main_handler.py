@@ -1,7 +1,28 @@
 import json
+from datetime import datetime
 
 from tornado.web import RequestHandler
 
+from i_database import DBConnection, use_read_replica
+from i_metrics import REQUEST_LATENCY
+from i_pagination import decode_cursor, encode_cursor
+
+#: rows of ndjson exports are written in chunks of this size
+NDJSON_CHUNK_SIZE = 500
+
+
+def parse_local_time(value: str) -> datetime:
+    """
+    parses an iso time of a request as a naive local time (times with offset are converted),
+    so it can be compared with other times of the program (caches, trends)
+    """
+    time = datetime.fromisoformat(value)
+
+    if time.tzinfo is not None:
+        time = time.astimezone().replace(tzinfo=None)
+
+    return time
+
 
 class _ArgNotFound:
     pass
@@ -16,7 +37,13 @@ class MainHandler(RequestHandler):
     """
     __json_args: dict = None
 
+    #: http methods of handler that only read db, they use read replicas
+    READ_ONLY_METHODS: tuple = ()
+
     def prepare(self):
+        if self.request.method in self.READ_ONLY_METHODS:
+            use_read_replica()
+
         #: sets the json (dict) of request body
         if self.request.headers.get("Content-Type", "").startswith("application/json"):
             self.__json_args = json.loads(self.request.body)
@@ -41,6 +68,62 @@ class MainHandler(RequestHandler):
 
         return defaultValue
 
+    def get_page_cursor(self) -> list:
+        """
+        decodes 'cursor' query argument (the cursor of previous page).
+        returns None for first page.
+        """
+        cursor = self.get_query_argument('cursor', None)
+
+        return decode_cursor(cursor) if cursor else None
+
+    def write_page(self, rows: list, count: int, cursor_callback, row_to_json = dict):
+        """
+        writes a page of a list api, with the cursor of next page.
+        'count + 1' rows must be read, the extra row shows that next page exists.
+
+        cursor_callback: returns sort key values of a row
+        """
+        has_next = len(rows) > count
+        rows = rows[:count]
+
+        self.write({
+            "data": list(
+                map(row_to_json, rows)
+            ),
+            "cursor": encode_cursor(cursor_callback(rows[-1])) if has_next else None
+        })
+
+    async def write_ndjson(self, conn: DBConnection, query: str, *args, row_to_json = dict):
+        """
+        streams all rows of a query as ndjson (one json per line).
+        rows are read by a db cursor and written in chunks, so they are not all loaded in memory.
+        """
+        self.set_header('Content-Type', 'application/x-ndjson')
+
+        lines = []
+        async with conn.transaction():
+            async for row in conn.cursor(query, *args, prefetch=NDJSON_CHUNK_SIZE):
+                lines.append(json.dumps(row_to_json(row)))
+
+                if len(lines) >= NDJSON_CHUNK_SIZE:
+                    self.write('\n'.join(lines) + '\n')
+                    lines = []
+
+                    #: waits for client to receive the chunk
+                    await self.flush()
+
+        if lines:
+            self.write('\n'.join(lines) + '\n')
+
+    def on_finish(self):
+        REQUEST_LATENCY.observe(
+            self.request.request_time(),
+            handler=type(self).__name__,
+            method=self.request.method,
+            status=self.get_status()
+        )
+
     def options(self):
         # no body
         self.set_status(204)
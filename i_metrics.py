@@ -0,0 +1,223 @@
+"""
+This module keeps program metrics, and renders them in prometheus text format.
+Metrics are served on '/api/metrics', by api server and by every crawl worker
+(on 'worker-metrics-port' of program settings), since every process has its own metrics.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+LabelValues = Tuple[str, ...]
+
+#: all metrics, in order of rendering
+__metrics: list = []
+
+
+class Counter:
+    """
+    a value that only increases
+    """
+    metric_type = 'counter'
+
+    def __init__(self, name: str, description: str, label_names: tuple = ()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.values: Dict[LabelValues, float] = {}
+        self.lock = threading.Lock()
+
+        register_metric(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_values(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        adds the seconds of running a block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc(time.perf_counter() - start, **labels)
+
+    def label_values(self, labels: dict) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            return [
+                f'{self.name}{render_labels(self.label_names, key)} {value}'
+                for key, value in self.values.items()
+            ]
+
+
+class Histogram(Counter):
+    """
+    counts of observed values, in buckets
+    """
+    metric_type = 'histogram'
+
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, description: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self.label_values(labels)
+
+        with self.lock:
+            #: bucket counts, sum, count
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0, 0]
+
+            observed = self.values[key]
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    observed[0][i] += 1
+            observed[1] += value
+            observed[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        observes the seconds of running a block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = []
+
+        with self.lock:
+            for key, (bucket_counts, value_sum, count) in self.values.items():
+                for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                    labels = render_labels(self.label_names + ('le',), key + (str(bucket),))
+                    lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+
+                labels = render_labels(self.label_names + ('le',), key + ('+Inf',))
+                lines.append(f'{self.name}_bucket{labels} {count}')
+
+                labels = render_labels(self.label_names, key)
+                lines.append(f'{self.name}_sum{labels} {value_sum}')
+                lines.append(f'{self.name}_count{labels} {count}')
+
+        return lines
+
+
+class Gauge(Counter):
+    """
+    a value that is read when metrics are rendered.
+    value_callback returns a value, or a dict of (label values -> value)
+    """
+    metric_type = 'gauge'
+
+    def __init__(self, name: str, description: str, value_callback: Callable, label_names: tuple = ()):
+        super().__init__(name, description, label_names)
+        self.value_callback = value_callback
+
+    def render(self) -> List[str]:
+        value = self.value_callback()
+
+        if value is None:
+            return []
+
+        if not isinstance(value, dict):
+            value = {(): value}
+
+        return [
+            f'{self.name}{render_labels(self.label_names, key)} {v}' for key, v in value.items()
+        ]
+
+
+def register_metric(metric: Counter):
+    __metrics.append(metric)
+
+
+def render_labels(label_names: tuple, label_values: tuple) -> str:
+    if not label_names:
+        return ''
+
+    labels = ','.join(
+        f'{name}="{value}"' for name, value in zip(label_names, label_values)
+    )
+
+    return '{' + labels + '}'
+
+
+def render_metrics() -> str:
+    """
+    renders all metrics in prometheus text format
+    """
+    lines = []
+
+    for metric in __metrics:
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {metric.metric_type}')
+        lines.extend(metric.render())
+
+    return '\n'.join(lines) + '\n'
+
+
+async def monitor_event_loop_lag(interval_second: float = 0.5):
+    """
+    measures how late the event loop wakes up a sleeping task
+    """
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval_second)
+
+        EVENT_LOOP_LAG.observe(
+            max(time.perf_counter() - start - interval_second, 0)
+        )
+
+
+#: metrics
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'latency of api requests',
+    ('handler', 'method', 'status')
+)
+
+DB_ACQUIRE_WAIT = Histogram(
+    'db_pool_acquire_wait_seconds',
+    'time of waiting for a connection from db pool'
+)
+
+TWEETS_SCRAPED = Counter(
+    'crawl_tweets_scraped_total',
+    'tweets received from twint'
+)
+
+TWEETS_ANALYZED = Counter(
+    'crawl_tweets_analyzed_total',
+    'tweets analyzed by text analyzer'
+)
+
+TWEETS_INSERTED = Counter(
+    'crawl_tweets_inserted_total',
+    'new tweets saved in db'
+)
+
+CRAWL_STAGE_SECONDS = Counter(
+    'crawl_stage_seconds_total',
+    'seconds spent in every stage of crawling a user (scrape, parse, analyze, save)',
+    ('stage',)
+)
+
+EVENT_LOOP_LAG = Histogram(
+    'event_loop_lag_seconds',
+    'delay of event loop in waking up tasks'
+)
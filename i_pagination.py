@@ -0,0 +1,44 @@
+"""
+This module provides opaque cursors for keyset pagination of list apis.
+A cursor keeps the sort key of the last row of a page, next page starts after it.
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values: list) -> str:
+    """
+    encodes sort key values of last row of a page
+    """
+    def to_json(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+
+        raise TypeError(f'can not encode {type(value).__name__} in cursor')
+
+    return base64.urlsafe_b64encode(
+        json.dumps(values, default=to_json).encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """
+    decodes a cursor made by 'encode_cursor'.
+    datetimes are returned as iso format strings.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError) as e:
+        raise InvalidCursor(f'invalid cursor: {cursor}') from e
+
+    if not isinstance(values, list):
+        raise InvalidCursor(f'invalid cursor: {cursor}')
+
+    return values
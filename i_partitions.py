@@ -0,0 +1,211 @@
+"""
+This module maintains monthly partitions of 'tweet' and 'tweet_token' (see r17 migration).
+
+    - partitions are created 'tweet-partition-months-ahead' months ahead (program settings),
+      and before saving tweets of a month that has no partition (old tweets)
+    - months older than 'tweet-retention-month' are removed as whole partitions (0 keeps all months):
+      'tweet-retention-mode' is 'drop' (tables are dropped) or 'archive' (tables are moved to 'archive' schema)
+
+'token_frequency' is not partitioned, so charts of removed months are kept.
+"""
+
+from datetime import datetime, timezone
+from typing import List, Optional, Set, Tuple
+
+from i_database import DBConnection, DBRows, get_db_context
+from i_events import publish_event
+from i_program_settings import get_all_settings, get_settings
+from i_user_stats import remove_tweets_stats
+
+#: only one of workers removes old partitions, by this lock
+RETENTION_LOCK_KEY = 19873
+
+#: months (year, month) that have partitions, they are not checked again in this process
+__known_months: Set[Tuple[int, int]] = set()
+
+
+def month_of(time: datetime) -> Tuple[int, int]:
+    """
+    returns (year, month) of a time, in UTC (months of partitions are in UTC)
+    """
+    time = time.astimezone(timezone.utc)
+
+    return time.year, time.month
+
+
+def get_retention_cutoff() -> Optional[datetime]:
+    """
+    returns start of the oldest month that is kept, None if all months are kept
+    """
+    retention_month = get_settings('tweet-retention-month')
+    if not retention_month:
+        return None
+
+    year, month = month_of(datetime.now(timezone.utc))
+
+    #: months since year 0
+    months = year * 12 + month - 1 - retention_month
+
+    return datetime(months // 12, months % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+async def ensure_tweet_partitions(times: List[datetime]):
+    """
+    creates partitions of the months of some times (times of tweets), if they don't exist.
+    it must not be called in a transaction, so other workers don't wait for it.
+    """
+    if not times:
+        return
+
+    since, until = min(times), max(times)
+
+    months = set(map(month_of, times))
+    if months <= __known_months:
+        return
+
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        await conn.execute('SELECT public.create_tweet_partitions($1, $2);', since, until)
+
+    __known_months.update(months)
+
+
+async def maintain_tweet_partitions() -> str:
+    """
+    creates partitions of next months, and removes partitions of months out of retention.
+
+    returns:
+        a report of changes
+    """
+    settings = get_all_settings()
+
+    now = datetime.now(timezone.utc)
+    months_ahead = settings['tweet-partition-months-ahead']
+
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        created_count = await conn.fetchval(
+            "SELECT public.create_tweet_partitions($1, $1 + make_interval(months => $2));",
+            now, months_ahead
+        )
+
+    removed = await remove_old_partitions(settings['tweet-retention-mode'])
+
+    return f'{created_count} months created, {len(removed)} months {settings["tweet-retention-mode"]}: {", ".join(removed)}'
+
+
+async def remove_old_partitions(mode: str) -> List[str]:
+    """
+    removes partitions of the months before retention cutoff.
+    'total_count' of tokens and stats of users are corrected, 'token_frequency' is kept.
+
+    mode: 'drop' or 'archive'
+
+    returns:
+        suffixes (YYYY_MM) of removed months
+    """
+    if mode not in ('drop', 'archive'):
+        raise ValueError(f'invalid tweet retention mode: {mode}')
+
+    cutoff = get_retention_cutoff()
+    if cutoff is None:
+        return []
+
+    cutoff_suffix = cutoff.strftime('%Y_%m')
+
+    removed = []
+
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        #: other workers skip removing, while one of them is removing
+        if not await conn.fetchval('SELECT pg_try_advisory_lock($1);', RETENTION_LOCK_KEY):
+            return removed
+
+        try:
+            rows: DBRows = await conn.fetch(
+                '''
+                SELECT substring(c.relname from 'tweet_(\\d{4}_\\d{2})$') AS suffix
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'public.tweet'::regclass
+                ORDER BY 1;
+                '''
+            )
+
+            for suffix in [row.get('suffix') for row in rows]:
+                #: YYYY_MM suffixes are in order of time
+                if suffix is None or suffix >= cutoff_suffix:
+                    continue
+
+                await __remove_month(conn, suffix, mode)
+
+                __known_months.discard(tuple(map(int, suffix.split('_'))))
+                removed.append(suffix)
+        finally:
+            await conn.execute('SELECT pg_advisory_unlock($1);', RETENTION_LOCK_KEY)
+
+    #: api servers read the time range of all tweets again
+    if removed:
+        await publish_event('partitions-removed', {'months': removed})
+
+    return removed
+
+
+async def __remove_month(conn: DBConnection, suffix: str, mode: str):
+    tweet_table = f'tweet_{suffix}'
+    token_table = f'tweet_token_{suffix}'
+
+    async with conn.transaction():
+        #: rows of tokens are locked in order of id (like saving tokens of tweets)
+        await conn.execute(
+            f'''
+            SELECT 1 FROM public."token"
+            WHERE id IN (SELECT token_id FROM public."{token_table}")
+            ORDER BY id
+            FOR UPDATE;
+            '''
+        )
+
+        await conn.execute(
+            f'''
+            UPDATE public."token" tk
+            SET total_count = tk.total_count - c.count
+            FROM (SELECT token_id, count(1) AS count FROM public."{token_table}" GROUP BY 1) c
+            WHERE tk.id = c.token_id;
+            '''
+        )
+
+        await conn.execute(f'ALTER TABLE public.tweet_token DETACH PARTITION public."{token_table}";')
+
+        if mode == 'drop':
+            await conn.execute(f'DROP TABLE public."{token_table}";')
+        else:
+            #: archived tables don't reference other tables
+            await __drop_foreign_keys(conn, token_table)
+
+        await conn.execute(f'ALTER TABLE public.tweet DETACH PARTITION public."{tweet_table}";')
+
+        #: after detaching, so first/last times of users are read from other months
+        rows: DBRows = await conn.fetch(
+            f'SELECT username, count(1) AS count FROM public."{tweet_table}" GROUP BY 1;'
+        )
+        await remove_tweets_stats(conn, {row.get('username'): row.get('count') for row in rows})
+
+        if mode == 'drop':
+            await conn.execute(f'DROP TABLE public."{tweet_table}";')
+            return
+
+        await __drop_foreign_keys(conn, tweet_table)
+
+        await conn.execute(f'ALTER TABLE public."{token_table}" SET SCHEMA archive;')
+        await conn.execute(f'ALTER TABLE public."{tweet_table}" SET SCHEMA archive;')
+
+
+async def __drop_foreign_keys(conn: DBConnection, table: str):
+    rows: DBRows = await conn.fetch(
+        "SELECT conname FROM pg_constraint WHERE conrelid = $1::regclass and contype = 'f';",
+        f'public."{table}"'
+    )
+
+    for row in rows:
+        await conn.execute(f'ALTER TABLE public."{table}" DROP CONSTRAINT "{row.get("conname")}";')
@@ -1,20 +1,95 @@
 """
-This module provides interface for accessing program settings
+This module provides interface for accessing program settings.
+
+Settings file is parsed once and an immutable copy is kept in memory.
+It is parsed again when the modification time of the file changes
+(checked at most once per 'SETTINGS_CHECK_SECOND'), or by 'reload_settings'.
+Functions subscribed by 'subscribe_settings' are called when settings change.
 """
+import asyncio
 import json
 import os
+import time
+from types import MappingProxyType
+from typing import Callable, Mapping
+
+SETTINGS_FILE = os.path.dirname(__file__) + '/program-settings.json'
+
+#: the file is not checked for changes more than once in this period
+SETTINGS_CHECK_SECOND = 1
+
+__settings: Mapping = None
+__settings_mtime: float = None
+__last_check: float = 0
+
+#: functions that are called with new settings, after settings change
+__subscribers = []
 
 
 def get_settings(setting_name):
     """
     gets a settings by its name
     """
-    with open(os.path.dirname(__file__) + '/program-settings.json', 'r') as settings:
-        return json.load(settings)[setting_name]
+    return get_all_settings()[setting_name]
+
 
-def get_all_settings():
+def get_all_settings() -> Mapping:
     """
     returns all settings
     """
-    with open(os.path.dirname(__file__) + '/program-settings.json', 'r') as settings:
-        return json.load(settings)
+    global __last_check
+
+    if __settings is None:
+        return reload_settings()
+
+    now = time.monotonic()
+    if now - __last_check >= SETTINGS_CHECK_SECOND:
+        __last_check = now
+
+        try:
+            if os.stat(SETTINGS_FILE).st_mtime != __settings_mtime:
+                reload_settings()
+        except (OSError, ValueError) as e:
+            #: keeps last valid settings
+            print(f'[settings][error][{e}]')
+
+    return __settings
+
+
+def reload_settings() -> Mapping:
+    """
+    parses settings file again, and notifies subscribers if settings are changed
+    """
+    global __settings, __settings_mtime
+
+    mtime = os.stat(SETTINGS_FILE).st_mtime
+    with open(SETTINGS_FILE, 'r') as settings:
+        new_settings = MappingProxyType(json.load(settings))
+
+    old_settings = __settings
+    __settings = new_settings
+    __settings_mtime = mtime
+
+    if old_settings is not None and dict(old_settings) != dict(new_settings):
+        for subscriber in list(__subscribers):
+            subscriber(new_settings)
+
+    return new_settings
+
+
+def subscribe_settings(callback: Callable[[Mapping], None]):
+    """
+    'callback' is called with new settings, after every change of settings
+    """
+    __subscribers.append(callback)
+
+
+async def watch_settings(interval_second: float = 5):
+    """
+    checks settings file for changes periodically, so subscribers are notified
+    even if settings are not read
+    """
+    while True:
+        await asyncio.sleep(interval_second)
+
+        get_all_settings()
@@ -0,0 +1,126 @@
+"""
+This module reports progress of tasks to clients ('task' event, see i_events).
+
+Updates of every task are coalesced:
+    - an update that changes 'percent' less than 'progress-emit-percent-step' (program settings) is dropped
+    - at most 'progress-emit-per-second' updates of a task are sent per second,
+      updates between them are merged (the last one is sent)
+    - the final update of a task is always sent
+
+A notification of postgres is at most 8000 bytes, so long states are truncated in events.
+"""
+
+import asyncio
+import time
+from typing import Dict, Optional
+
+from i_events import publish_event
+from i_program_settings import get_all_settings
+
+
+class _TaskProgress:
+    """
+    progress of a task that is reported in this process
+    """
+
+    def __init__(self):
+        #: time and percent of last sent update
+        self.sent_time: float = 0
+        self.sent_percent: Optional[float] = None
+
+        #: the update that waits for sending, and its timer
+        self.pending: Optional[dict] = None
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+
+
+#: task id -> progress
+__tasks: Dict[int, _TaskProgress] = {}
+
+#: progress of a task that is not updated for this time is forgotten
+#: (a task can be finished by another process)
+TASK_IDLE_SECOND = 3600
+
+#: 'state' of events is truncated to this length
+MAX_EVENT_STATE_LENGTH = 1000
+
+
+async def report_progress(task_id, state: str, percent: float = None, final: bool = False):
+    """
+    reports a new state (and percent) of a task.
+    'final' must be set for the last update of a task.
+    """
+    settings = get_all_settings()
+
+    if len(state) > MAX_EVENT_STATE_LENGTH:
+        state = state[:MAX_EVENT_STATE_LENGTH] + '...'
+
+    event = {'id': task_id, 'state': state}
+    if percent is not None:
+        event['percent'] = percent
+
+    progress = __tasks.setdefault(task_id, _TaskProgress())
+
+    if final:
+        if progress.flush_handle is not None:
+            progress.flush_handle.cancel()
+        del __tasks[task_id]
+
+        __forget_idle_tasks()
+
+        await __publish(task_id, event)
+        return
+
+    if percent is not None and progress.sent_percent is not None and \
+            abs(percent - progress.sent_percent) < settings['progress-emit-percent-step']:
+        return
+
+    wait_second = progress.sent_time + 1 / settings['progress-emit-per-second'] - time.monotonic()
+
+    if wait_second <= 0 and progress.flush_handle is None:
+        await __send(task_id, progress, event)
+        return
+
+    #: sent by timer, with newer updates
+    progress.pending = event
+    if progress.flush_handle is None:
+        progress.flush_handle = asyncio.get_event_loop().call_later(
+            max(wait_second, 0), lambda: asyncio.ensure_future(__flush(task_id, progress))
+        )
+
+
+def __forget_idle_tasks():
+    idle_time = time.monotonic() - TASK_IDLE_SECOND
+
+    for task_id in [
+        task_id for task_id, progress in __tasks.items()
+        if progress.flush_handle is None and progress.sent_time < idle_time
+    ]:
+        del __tasks[task_id]
+
+
+async def __send(task_id, progress: _TaskProgress, event: dict):
+    progress.sent_time = time.monotonic()
+    progress.sent_percent = event.get('percent', progress.sent_percent)
+
+    await __publish(task_id, event)
+
+
+async def __publish(task_id, event: dict):
+    #: the task is saved in db before, so an error of events doesn't stop the caller
+    try:
+        await publish_event('task', event)
+    except Exception as e:
+        print(f'[progress][task:{task_id}][error][{e}]')
+
+
+async def __flush(task_id, progress: _TaskProgress):
+    progress.flush_handle = None
+
+    event = progress.pending
+    progress.pending = None
+
+    #: the task is finished meanwhile
+    if __tasks.get(task_id) is not progress or event is None:
+        return
+
+    await __send(task_id, progress, event)
@@ -1,8 +1,13 @@
 """
 This module is used for serving socket-io connections.
 Also provides socket-io object for emitting messages to clients.
+
+Events of a task ('task' event) are sent to the room of the task,
+clients join it by 'subscribe-task' (with task id) and leave it by 'unsubscribe-task'.
 """
 
+import inspect
+
 import socketio
 
 __sio = socketio.AsyncServer()
@@ -19,6 +24,27 @@ def disconnect(sid):
     print('disconnect ', sid)
 
 
+@__sio.on('subscribe-task')
+async def subscribe_task(sid, task_id):
+    result = __sio.enter_room(sid, task_room(task_id))
+
+    #: it is a coroutine in newer versions of python-socketio
+    if inspect.isawaitable(result):
+        await result
+
+
+@__sio.on('unsubscribe-task')
+async def unsubscribe_task(sid, task_id):
+    result = __sio.leave_room(sid, task_room(task_id))
+
+    if inspect.isawaitable(result):
+        await result
+
+
+def task_room(task_id) -> str:
+    return f'task:{task_id}'
+
+
 def get_sio() -> socketio.AsyncServer:
     if __app is None:
         __init_socket()
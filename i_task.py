@@ -5,10 +5,16 @@ This is an interface for managing tasks in db.
 import asyncio
 from datetime import datetime
 
-from i_database import DBConnection, DBRow, get_db_context
+from i_database import DBConnection, DBRow, get_db_context, hot_query
 
+__TASK_STATE_UPDATE = hot_query(
+    'task-state-update',
+    "UPDATE public.program_task SET task_state=$1, task_status=coalesce($3, task_status) WHERE id=$2;"
+)
 
-async def create_task(task_type, task_state, crawl_since: datetime, crawl_until: datetime, task_user=None) -> int:
+
+async def create_task(
+    task_type, task_state, crawl_since: datetime, crawl_until: datetime, task_user=None, conn: DBConnection = None) -> int:
     """
     creates a task in db
     
@@ -16,38 +22,45 @@ async def create_task(task_type, task_state, crawl_since: datetime, crawl_until:
         task_type: is one of these
             'user-crawl'
             'total-crawl'
+            'dictionary-apply' (job)
+            'tweets-delete' (job)
+        conn: the task is created in this connection (in its transaction), if specified
     """
 
-    conn: DBConnection
-    async with await get_db_context() as conn:
-        async with conn.transaction():
-
-            row: DBRow = await conn.fetchrow(
-                '''
-                INSERT INTO public.program_task
-                    (task_user, task_type, task_state, crawl_since, crawl_until)
-                VALUES
-                    ($1, $2, $3, $4, $5)
-                RETURNING "id";
-                ''',
-                task_user,
-                task_type,
-                task_state,
-                crawl_since,
-                crawl_until
-            )
-
-            return row.get('id')
-
-
-async def change_task_state(task_id, new_task_state):
+    if conn is None:
+        async with await get_db_context() as conn:
+            async with conn.transaction():
+                return await create_task(
+                    task_type, task_state, crawl_since, crawl_until, task_user, conn
+                )
+
+    row: DBRow = await conn.fetchrow(
+        '''
+        INSERT INTO public.program_task
+            (task_user, task_type, task_state, crawl_since, crawl_until)
+        VALUES
+            ($1, $2, $3, $4, $5)
+        RETURNING "id";
+        ''',
+        task_user,
+        task_type,
+        task_state,
+        crawl_since,
+        crawl_until
+    )
+
+    return row.get('id')
+
+
+async def change_task_state(task_id, new_task_state, task_status: str = None):
     """
     changes the task state by its id (task_id).
+    task_status: 'pending', 'running', 'done' or 'failed', it is not changed if not specified
     """
     conn: DBConnection
     async with await get_db_context() as conn:
-        await conn.execute(
-            "UPDATE public.program_task SET task_state=$1 WHERE id=$2;",
+        await (await conn.hot(__TASK_STATE_UPDATE)).fetch(
             new_task_state,
-            task_id
+            task_id,
+            task_status
         )
@@ -0,0 +1,236 @@
+"""
+This module maintains 'token_frequency' table and 'token' table (vocabulary).
+'token_frequency' keeps count of every token, per hour and username,
+so charts don't need to count 'tweet_token' rows.
+'token' gives an id to every token ('tweet_token' keeps the id), and keeps its count in all tweets.
+
+run this module for building the table from existing tweets:
+    python i_token_frequency.py
+"""
+
+import asyncio
+from typing import Dict
+
+from i_database import DBConnection, DBRows, connect_db, hot_query
+
+#: adds 'count' of the rows of a select query (with columns: token, hour_bucket, username, count)
+__ADD_FREQUENCIES = '''
+INSERT INTO public.token_frequency ("token", hour_bucket, username, count)
+{select_query}
+ON CONFLICT ("token", hour_bucket, username)
+DO UPDATE SET count = token_frequency.count + excluded.count;
+'''
+
+
+#: hot queries of saving tokens of tweets
+
+__TOKEN_INSERT = hot_query('token-insert', '''
+INSERT INTO public."token" ("token")
+SELECT DISTINCT t FROM unnest($1::varchar[]) t ORDER BY 1
+ON CONFLICT DO NOTHING;
+''')
+
+__TOKEN_IDS = hot_query('token-ids', '''
+SELECT id, "token" FROM public."token"
+WHERE "token" = ANY($1::varchar[])
+ORDER BY id
+FOR UPDATE;
+''')
+
+__TWEET_TOKENS_INSERT = hot_query('tweet-tokens-insert', '''
+WITH inserted AS (
+    INSERT INTO public.tweet_token (tweet_id, tweet_time, token_id)
+    SELECT * FROM unnest($1::int8[], $2::timestamptz[], $3::int4[])
+    ON CONFLICT DO NOTHING
+    RETURNING tweet_id, tweet_time, token_id
+), added AS (
+    SELECT tk."token", date_trunc('hour', t.tweet_time) AS hour_bucket, t.username, count(1) AS count
+    FROM inserted i
+    JOIN public.tweet t ON t.tweet_id = i.tweet_id and t.tweet_time = i.tweet_time
+    JOIN public."token" tk ON tk.id = i.token_id
+    GROUP BY 1, 2, 3
+), upserted AS (
+    INSERT INTO public.token_frequency ("token", hour_bucket, username, count)
+    SELECT * FROM added
+    ON CONFLICT ("token", hour_bucket, username)
+    DO UPDATE SET count = token_frequency.count + excluded.count
+), counted AS (
+    UPDATE public."token" tk
+    SET total_count = tk.total_count + c.count
+    FROM (SELECT token_id, count(1) AS count FROM inserted GROUP BY 1) c
+    WHERE tk.id = c.token_id
+)
+SELECT * FROM added;
+''')
+
+
+async def add_tokens(conn: DBConnection, tokens: list) -> Dict[str, int]:
+    """
+    adds new tokens to 'token' table (vocabulary), and returns ids of the tokens.
+    rows of the tokens are locked in order of id, so transactions that change
+    'total_count' of common tokens wait for each other instead of deadlock.
+
+    must be called in a transaction.
+    """
+    await (await conn.hot(__TOKEN_INSERT)).fetch(tokens)
+
+    rows: DBRows = await (await conn.hot(__TOKEN_IDS)).fetch(list(set(tokens)))
+
+    return {row.get('token'): row.get('id') for row in rows}
+
+
+async def add_tweet_tokens(conn: DBConnection, tweet_ids: list, tweet_times: list, tokens: list) -> DBRows:
+    """
+    saves tokens of tweets in 'tweet_token', and adds them to frequencies
+    and to 'total_count' of vocabulary.
+    the pairs of (tweet_id, token) that exist already are skipped.
+    'tweet_times' are times of the tweets (the partition key of 'tweet_token').
+
+    must be called in a transaction.
+
+    returns:
+        added frequencies, rows of ("token", hour_bucket, username, count)
+    """
+    token_ids = await add_tokens(conn, tokens)
+
+    return await (await conn.hot(__TWEET_TOKENS_INSERT)).fetch(
+        tweet_ids, tweet_times, [token_ids[token] for token in tokens]
+    )
+
+
+async def remove_tweets_frequencies(conn: DBConnection, username, tweet_ids: list = None):
+    """
+    removes tokens of some tweets of a user (or all of them, without tweet_ids)
+    from frequencies and from 'total_count' of vocabulary.
+    it must be called before deleting the tweets, in the same transaction.
+    """
+    removed: DBRows = await conn.fetch(
+        f'''
+        SELECT tt.token_id, date_trunc('hour', t.tweet_time) AS hour_bucket, count(1) AS count
+        FROM public.tweet t
+        JOIN public.tweet_token tt ON tt.tweet_id = t.tweet_id and tt.tweet_time = t.tweet_time
+        WHERE
+            t.username = $1
+            {'and t.tweet_id = ANY($2::int8[])' if tweet_ids is not None else ''}
+        GROUP BY 1, 2;
+        ''',
+        username,
+        *([tweet_ids] if tweet_ids is not None else [])
+    )
+
+    if not removed:
+        return
+
+    await __lock_token_ids(conn, [row.get('token_id') for row in removed])
+
+    await conn.execute(
+        '''
+        WITH removed AS (
+            SELECT * FROM unnest($1::int4[], $2::timestamptz[], $3::int8[]) AS r (token_id, hour_bucket, count)
+        ), frequencies AS (
+            UPDATE public.token_frequency f
+            SET count = f.count - r.count
+            FROM removed r
+            JOIN public."token" tk ON tk.id = r.token_id
+            WHERE
+                f."token" = tk."token" and
+                f.hour_bucket = r.hour_bucket and
+                f.username = $4
+        )
+        UPDATE public."token" tk
+        SET total_count = tk.total_count - c.count
+        FROM (SELECT token_id, sum(count) AS count FROM removed GROUP BY 1) c
+        WHERE tk.id = c.token_id;
+        ''',
+        [row.get('token_id') for row in removed],
+        [row.get('hour_bucket') for row in removed],
+        [row.get('count') for row in removed],
+        username
+    )
+
+    await conn.execute(
+        'DELETE FROM public.token_frequency WHERE username = $1 and count <= 0;',
+        username
+    )
+
+
+async def rebuild_tokens_frequencies(conn: DBConnection, tokens: list):
+    """
+    counts frequencies and 'total_count' of some tokens again, from 'tweet_token'.
+    it is used after changing tokens by dictionary.
+
+    must be called in a transaction.
+    """
+    token_ids = await add_tokens(conn, tokens)
+
+    await conn.execute(
+        'DELETE FROM public.token_frequency WHERE "token" = ANY($1::varchar[]);',
+        tokens
+    )
+
+    await conn.execute(
+        __ADD_FREQUENCIES.format(select_query='''
+        SELECT tk."token", date_trunc('hour', t.tweet_time), t.username, count(1)
+        FROM public.tweet_token tt
+        JOIN public.tweet t ON t.tweet_id = tt.tweet_id and t.tweet_time = tt.tweet_time
+        JOIN public."token" tk ON tk.id = tt.token_id
+        WHERE tt.token_id = ANY($1::int4[])
+        GROUP BY 1, 2, 3
+        '''),
+        list(token_ids.values())
+    )
+
+    await conn.execute(
+        '''
+        UPDATE public."token" tk
+        SET total_count = (SELECT count(1) FROM public.tweet_token tt WHERE tt.token_id = tk.id)
+        WHERE tk.id = ANY($1::int4[]);
+        ''',
+        list(token_ids.values())
+    )
+
+
+async def __lock_token_ids(conn: DBConnection, token_ids: list):
+    """
+    locks rows of tokens in order of id (like 'add_tokens')
+    """
+    await conn.execute(
+        'SELECT 1 FROM public."token" WHERE id = ANY($1::int4[]) ORDER BY id FOR UPDATE;',
+        list(set(token_ids))
+    )
+
+
+async def backfill_token_frequency():
+    """
+    builds all of 'token_frequency' table, and 'total_count' of tokens, from existing tweets.
+    it can take long, so it uses a connection out of the pool (without 'db-command-timeout-second').
+    """
+    conn = await connect_db()
+    try:
+        async with conn.transaction():
+
+            await conn.execute('TRUNCATE public.token_frequency;')
+
+            await conn.execute(
+                __ADD_FREQUENCIES.format(select_query='''
+                SELECT tk."token", date_trunc('hour', t.tweet_time), t.username, count(1)
+                FROM public.tweet_token tt
+                JOIN public.tweet t ON t.tweet_id = tt.tweet_id and t.tweet_time = tt.tweet_time
+                JOIN public."token" tk ON tk.id = tt.token_id
+                GROUP BY 1, 2, 3
+                ''')
+            )
+
+            await conn.execute(
+                '''
+                UPDATE public."token" tk
+                SET total_count = (SELECT count(1) FROM public.tweet_token tt WHERE tt.token_id = tk.id);
+                '''
+            )
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(backfill_token_frequency())
+    print('token_frequency is built')
@@ -0,0 +1,303 @@
+"""
+This module finds the most frequent tokens of a time range.
+
+Counts of recent hours ('trends-memory-hour' in program settings) are kept in memory,
+per hour bucket. They are read from 'token_frequency' once, and when crawl workers save tokens
+of some hours, only those hours are read again.
+A range that has all tweets in db (without usernames) is read from 'total_count' of 'token' table.
+The time range of all tweets is kept in memory too, until tweets are saved or removed.
+Older ranges, or ranges filtered by usernames, are read from 'token_frequency' table.
+"""
+
+import asyncio
+import heapq
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from i_database import DBConnection, DBRow, DBRows, get_db_context
+from i_program_settings import get_settings
+
+TokenCount = Tuple[str, int]
+
+#: hour bucket -> counts of tokens in that hour
+__hour_counts: Dict[datetime, Counter] = None
+
+#: first hour bucket that is kept in memory
+__memory_since: datetime = None
+
+#: hour buckets that are changed in db, they are read again at next call
+__stale_hours: Set[datetime] = set()
+
+#: increases when counts in memory are invalidated, so counts that are read meanwhile are not kept
+__generation = 0
+
+#: (first, last) time of all tweets, None if it is not read. (None, None) if there is no tweet.
+__corpus_range: Optional[Tuple[datetime, datetime]] = None
+
+#: increases when the range of all tweets is invalidated
+__corpus_generation = 0
+
+__load_lock = asyncio.Lock()
+
+
+async def get_top_tokens(
+    count: int, since: datetime, until: datetime, usernames: list = None) -> List[TokenCount]:
+    """
+    returns 'count' most frequent tokens of a time range,
+    as (token, frequency), ordered by frequency
+    """
+
+    if usernames:
+        return await __get_top_tokens_db(count, since, until, usernames)
+
+    if await __is_full_corpus(since, until):
+        return await __get_top_tokens_total(count)
+
+    hour_counts = await __get_memory_counts(since)
+
+    if hour_counts is not None:
+        window = Counter()
+        for hour_bucket, token_counts in list(hour_counts.items()):
+            if since - timedelta(hours=1) < hour_bucket <= until:
+                window.update(token_counts)
+
+        return heapq.nlargest(count, window.items(), key=lambda x: x[1])
+
+    return await __get_top_tokens_db(count, since, until, usernames)
+
+
+def invalidate_trend_hours(hour_buckets: Iterable[datetime]):
+    """
+    counts of these hours will be read from db again, at next call.
+    it is used after crawl workers save tokens.
+    """
+    invalidate_corpus_range()
+
+    if __hour_counts is None:
+        return
+
+    for hour_bucket in hour_buckets:
+        hour_bucket = __local_time(hour_bucket)
+
+        if hour_bucket >= __memory_since:
+            __stale_hours.add(hour_bucket)
+
+
+def invalidate_trends():
+    """
+    counts in memory will be read from db again, at next call.
+    it is used when frequencies of many hours are changed (dictionary, deleting tweets).
+    """
+    global __hour_counts, __generation
+
+    __hour_counts = None
+    __stale_hours.clear()
+    __generation += 1
+
+    invalidate_corpus_range()
+
+
+def invalidate_corpus_range():
+    """
+    the time range of all tweets will be read from db again, at next call.
+    it is used when tweets are saved or removed (also by removing old partitions).
+    """
+    global __corpus_range, __corpus_generation
+
+    __corpus_range = None
+    __corpus_generation += 1
+
+
+async def __get_memory_counts(since: datetime) -> Optional[Dict[datetime, Counter]]:
+    """
+    loads counts if needed, and returns them if the range starts in memory.
+    returns None if the range is not in memory, or counts are invalidated while loading.
+    """
+
+    memory_hour = get_settings('trends-memory-hour')
+    memory_since = (datetime.now() - timedelta(hours=memory_hour)).replace(
+        minute=0, second=0, microsecond=0
+    )
+
+    if since < memory_since:
+        return None
+
+    async with __load_lock:
+        if __hour_counts is None:
+            await __load_counts(memory_since)
+        else:
+            __forget_before(memory_since)
+
+            if __stale_hours:
+                await __reload_hours()
+
+        if __hour_counts is None or since < __memory_since:
+            return None
+
+        return __hour_counts
+
+
+def __forget_before(memory_since: datetime):
+    """
+    removes hours that are not recent anymore
+    """
+    global __memory_since
+
+    for hour_bucket in [h for h in __hour_counts if h < memory_since]:
+        del __hour_counts[hour_bucket]
+
+    __memory_since = max(__memory_since, memory_since)
+
+
+async def __load_counts(memory_since: datetime):
+    global __hour_counts, __memory_since
+
+    generation = __generation
+
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        rows: DBRows = await conn.fetch(
+            '''
+            SELECT f.hour_bucket, f."token", sum(f.count)::int8 AS count
+            FROM public.token_frequency f
+            WHERE f.hour_bucket >= $1
+            GROUP BY 1, 2;
+            ''',
+            memory_since
+        )
+
+    #: invalidated while reading
+    if generation != __generation:
+        return
+
+    hour_counts: Dict[datetime, Counter] = {}
+    for row in rows:
+        hour_bucket = __local_time(row.get('hour_bucket'))
+        hour_counts.setdefault(hour_bucket, Counter())[row.get('token')] = row.get('count')
+
+    __memory_since = memory_since
+    __hour_counts = hour_counts
+
+
+async def __reload_hours():
+    hour_buckets = [h for h in __stale_hours if h >= __memory_since]
+    __stale_hours.clear()
+
+    if not hour_buckets:
+        return
+
+    generation = __generation
+
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        rows: DBRows = await conn.fetch(
+            '''
+            SELECT f.hour_bucket, f."token", sum(f.count)::int8 AS count
+            FROM public.token_frequency f
+            WHERE f.hour_bucket = ANY($1::timestamptz[])
+            GROUP BY 1, 2;
+            ''',
+            hour_buckets
+        )
+
+    #: invalidated while reading
+    if generation != __generation:
+        return
+
+    for hour_bucket in hour_buckets:
+        __hour_counts[hour_bucket] = Counter()
+
+    for row in rows:
+        __hour_counts[__local_time(row.get('hour_bucket'))][row.get('token')] = row.get('count')
+
+
+def __local_time(d: datetime) -> datetime:
+    """
+    db returns times in utc, but naive times of requests are local (same as asyncpg)
+    """
+    return d.astimezone().replace(tzinfo=None)
+
+
+async def __is_full_corpus(since: datetime, until: datetime) -> bool:
+    """
+    checks that the range has all tweets in db (by first and last tweets of users)
+    """
+    first, last = await __get_corpus_range()
+
+    if first is None:
+        return False
+
+    return since <= first and until >= last
+
+
+async def __get_corpus_range() -> Tuple[Optional[datetime], Optional[datetime]]:
+    global __corpus_range
+
+    if __corpus_range is not None:
+        return __corpus_range
+
+    generation = __corpus_generation
+
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        row: DBRow = await conn.fetchrow(
+            'SELECT min(first_tweet_time) AS first, max(last_tweet_time) AS last FROM public.twitter_user_stats;'
+        )
+
+    corpus_range = (None, None) if row.get('first') is None else \
+        (__local_time(row.get('first')), __local_time(row.get('last')))
+
+    #: invalidated while reading
+    if generation == __corpus_generation:
+        __corpus_range = corpus_range
+
+    return corpus_range
+
+
+async def __get_top_tokens_total(count: int) -> List[TokenCount]:
+    """
+    most frequent tokens of all tweets, by the index of 'total_count'
+    """
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        rows: DBRows = await conn.fetch(
+            '''
+            SELECT "token", total_count AS count FROM public."token"
+            WHERE total_count > 0
+            ORDER BY total_count DESC, id DESC
+            LIMIT $1;
+            ''',
+            count
+        )
+
+    return [(row.get('token'), row.get('count')) for row in rows]
+
+
+async def __get_top_tokens_db(
+    count: int, since: datetime, until: datetime, usernames: list) -> List[TokenCount]:
+
+    args = [since, until, count]
+
+    usernames_caluse = ''
+    if usernames:
+        args.append(usernames)
+        usernames_caluse = ' AND f.username = ANY($4::varchar[])'
+
+    conn: DBConnection
+    async with await get_db_context() as conn:
+        rows: DBRows = await conn.fetch(
+            f'''
+            SELECT f."token", sum(f.count)::int8 AS count
+            FROM public.token_frequency f
+            WHERE
+                f.hour_bucket > $1::timestamptz - interval '1 hour'
+                AND f.hour_bucket <= $2 {usernames_caluse}
+            GROUP BY 1
+            ORDER BY 2 DESC
+            LIMIT $3;
+            ''',
+            *args
+        )
+
+    return [(row.get('token'), row.get('count')) for row in rows]
@@ -0,0 +1,79 @@
+"""
+This module maintains 'twitter_user_stats' table: count and first/last time of tweets of every user,
+and the last crawl of the user. user api reads it, instead of counting tweets.
+
+    - saving tweets adds them to the stats (by the tweet insert query of crawler)
+    - a done crawl job sets 'last_crawled_at' and 'last_task_id'
+    - deleting tweets (user api, retention of partitions) removes them from the stats
+"""
+
+from typing import Dict
+
+from i_database import DBConnection
+
+#: adds inserted tweets to stats, it is a part of a query that has 'inserted' (username, tweet_time)
+ADD_TWEETS_STATS = '''
+INSERT INTO public.twitter_user_stats (username, tweet_count, first_tweet_time, last_tweet_time)
+SELECT username, count(1), min(tweet_time), max(tweet_time)
+FROM inserted
+GROUP BY 1
+ORDER BY 1
+ON CONFLICT (username) DO UPDATE SET
+    tweet_count = twitter_user_stats.tweet_count + excluded.tweet_count,
+    first_tweet_time = least(twitter_user_stats.first_tweet_time, excluded.first_tweet_time),
+    last_tweet_time = greatest(twitter_user_stats.last_tweet_time, excluded.last_tweet_time)
+'''
+
+
+async def set_user_crawled(conn: DBConnection, username, task_id):
+    """
+    saves the last crawl of a user (a done crawl job)
+    """
+    await conn.execute(
+        '''
+        INSERT INTO public.twitter_user_stats (username, last_crawled_at, last_task_id)
+        VALUES ($1, now(), $2)
+        ON CONFLICT (username) DO UPDATE SET
+            last_crawled_at = excluded.last_crawled_at,
+            last_task_id = excluded.last_task_id;
+        ''',
+        username, task_id
+    )
+
+
+async def remove_tweets_stats(conn: DBConnection, removed_counts: Dict[str, int]):
+    """
+    removes deleted tweets from stats of their users.
+    first/last times are read again from 'tweet', so it must be called after deleting the tweets.
+
+    removed_counts: username -> count of deleted tweets
+    """
+    if not removed_counts:
+        return
+
+    usernames = sorted(removed_counts)
+
+    #: rows are locked in order of username (like saving tweets)
+    await conn.execute(
+        '''
+        SELECT 1 FROM public.twitter_user_stats
+        WHERE username = ANY($1::varchar[])
+        ORDER BY username
+        FOR UPDATE;
+        ''',
+        usernames
+    )
+
+    await conn.execute(
+        '''
+        UPDATE public.twitter_user_stats s
+        SET
+            tweet_count = greatest(s.tweet_count - r.count, 0),
+            first_tweet_time = (SELECT min(t.tweet_time) FROM public.tweet t WHERE t.username = s.username),
+            last_tweet_time = (SELECT max(t.tweet_time) FROM public.tweet t WHERE t.username = s.username)
+        FROM unnest($1::varchar[], $2::int8[]) AS r (username, count)
+        WHERE s.username = r.username;
+        ''',
+        usernames,
+        [removed_counts[username] for username in usernames]
+    )
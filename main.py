@@ -1,10 +1,11 @@
 """
-Program entry point
+Program entry point: api server and socket.io server.
+Crawls are done by worker processes ('worker.py').
 """
 
 import asyncio
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
 
 import socketio
 import tornado
@@ -12,9 +13,14 @@ from tornado.web import url as rout_url
 
 import handlers
 import i_socket_io
-from crawl_analyze.crawl import crawl_total
-from i_program_settings import get_settings
-from i_task import change_task_state, create_task
+from i_chart_cache import invalidate_tweet_hours
+from i_database import init_db
+from i_events import listen_events, subscribe_event
+from i_jobs import fail_orphaned_jobs
+from i_metrics import monitor_event_loop_lag
+from i_program_settings import watch_settings
+from i_trends import (invalidate_corpus_range, invalidate_trend_hours,
+                      invalidate_trends)
 
 
 def prepare_tornado():
@@ -32,8 +38,14 @@ def prepare_tornado():
         rout_url(r"/api/user", handlers.user.UserHandler),
         rout_url(r"/api/dict", handlers.dictionary.DictionaryHandler),
         rout_url(r"/api/task", handlers.task.TaskHandler),
+        rout_url(r"/api/token", handlers.tokens.TokenHandler),
         rout_url(r"/api/chart", handlers.chart.ChartHandler),
-        # rout_url(r"/api/chart/search", handlers.chart.ChartSearchHandler),
+        rout_url(r"/api/chart/cache", handlers.chart.ChartCacheHandler),
+        rout_url(r"/api/trends", handlers.trends.TrendsHandler),
+        rout_url(r"/api/metrics", handlers.metrics.MetricsHandler),
+        rout_url(r"/api/settings", handlers.settings.SettingsHandler),
+        rout_url(r"/api/search/token", handlers.search.TokenSearchHandler),
+        rout_url(r"/api/search/tweet", handlers.search.TweetSearchHandler),
 
         rout_url(
             r"/(.*)", tornado.web.StaticFileHandler,
@@ -46,62 +58,51 @@ def prepare_tornado():
     print(f"app started on port: {port}")
 
 
-async def total_crawl_runner():
+def on_tokens_saved(data: dict):
     """
-    Crawles users with crawl peremission ('isCrawl' column must be true for the user in db),
-    in time intervals.
-    After each crawl, sleeps for a while, specified by 'crawl-interval-hour' in program settings.
+    crawl workers saved tokens of some users and hours, charts and trends of them are changed
     """
+    invalidate_tweet_hours(
+        data['usernames'],
+        datetime.fromisoformat(data['first-hour']),
+        datetime.fromisoformat(data['last-hour'])
+    )
 
-    #: intital crawl period
-    until = datetime.now()
-    since = until - timedelta(hours=get_settings('crawl-interval-hour'))
+    if data['hours'] is None:
+        invalidate_trends()
+    else:
+        invalidate_trend_hours(datetime.fromisoformat(h) for h in data['hours'])
 
-    while True:
-        try:
-            #: 'since' for next intrval
-            new_since = datetime.now()
 
-            #: sleep
-            sleep_count_hour = get_settings('crawl-interval-hour')
-
-            print(f'[total-crawl][sleep for {sleep_count_hour} hours]')
-            
-            await asyncio.sleep(
-                sleep_count_hour * 60 * 60
-            )
+def subscribe_worker_events():
+    """
+    crawl workers send events by db, api server relays them to socket.io clients and updates its caches
+    """
+    subscribe_event(
+        'task',
+        lambda data: i_socket_io.get_sio().emit('task', data, room=i_socket_io.task_room(data['id']))
+    )
+    subscribe_event('tokens-saved', on_tokens_saved)
+    subscribe_event('partitions-removed', lambda data: invalidate_corpus_range())
 
-            #: create crawl task in db
-            task_id = await create_task(
-                'total-crawl', 'not started', since, until
-            )
 
-            #: crawl
-            print(f'[total-crawl][task:{task_id}][starting crawl][from {since.isoformat()} to {until.isoformat()}]')
-            all_user_count, all_tweet_crawled_count = await crawl_total(
-                task_id,
-                since.strftime("%Y-%m-%d %H:%M:%S"),
-                until.strftime("%Y-%m-%d %H:%M:%S")
-            )
+if __name__ == "__main__":
+    prepare_tornado()
 
-            message = f'crawled:{all_tweet_crawled_count} tweets of {all_user_count} user'
-            print(f'[total-crawl][task:{task_id}][end crawl][{message}]')
+    loop = asyncio.get_event_loop()
 
-            await change_task_state(task_id, message)
+    #: opens connections of db pool before serving requests
+    loop.run_until_complete(init_db())
 
-            #: set the period for next interval
-            since = new_since
-            until = datetime.now()
+    failed_jobs = loop.run_until_complete(fail_orphaned_jobs())
+    if failed_jobs:
+        print(f'[job][{failed_jobs} jobs stopped by restart are failed]')
 
-        except Exception as e:
-            #: because of error, since will not change
-            until = datetime.now()
-            print(f'[total-crawl][task:{task_id}][error][{e}]')
+    loop.create_task(monitor_event_loop_lag())
 
-if __name__ == "__main__":
-    prepare_tornado()
+    subscribe_worker_events()
+    loop.create_task(listen_events())
 
-    loop = asyncio.get_event_loop()
-    loop.create_task(total_crawl_runner())
+    loop.create_task(watch_settings())
 
     tornado.ioloop.IOLoop.current().start()
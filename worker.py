@@ -0,0 +1,144 @@
+"""
+Crawl worker entry point.
+It crawls jobs of the crawl queue (in db), and adds a total crawl task to the queue in every interval.
+It also maintains partitions of tweets.
+Many workers can run together, on one or more hosts.
+
+Metrics of a worker (crawled tweets, ...) are served on '/api/metrics' of 'worker-metrics-port'
+(program settings, 0 disables it). If the port is used by another worker of the host, it is not served.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import tornado.web
+from tornado.web import url as rout_url
+
+from crawl_analyze.crawl_queue import (create_total_crawl_task,
+                                       get_last_crawl_until, run_crawl_queue)
+from handlers.metrics import MetricsHandler
+from i_database import init_db
+from i_dictionary import subscribe_dictionary_events
+from i_events import listen_events
+from i_metrics import monitor_event_loop_lag
+from i_partitions import maintain_tweet_partitions
+from i_program_settings import get_settings, subscribe_settings, watch_settings
+
+#: it is set when program settings change
+settings_changed = asyncio.Event()
+
+
+async def sleep_crawl_interval(sleep_start: datetime = None):
+    """
+    sleeps for 'crawl-interval-hour' (program settings), from 'sleep_start' (now by default).
+    if the setting changes while sleeping, sleep time is calculated again by new interval.
+    """
+    sleep_start = sleep_start or datetime.now()
+
+    while True:
+        sleep_count_hour = get_settings('crawl-interval-hour')
+
+        remaining_second = (
+            sleep_start + timedelta(hours=sleep_count_hour) - datetime.now()
+        ).total_seconds()
+
+        if remaining_second <= 0:
+            return
+
+        print(f'[total-crawl][sleep for {remaining_second / 3600:.2f} hours]')
+
+        settings_changed.clear()
+        try:
+            await asyncio.wait_for(settings_changed.wait(), remaining_second)
+        except asyncio.TimeoutError:
+            return
+
+
+async def total_crawl_runner():
+    """
+    Crawles users with crawl peremission ('isCrawl' column must be true for the user in db),
+    in time intervals, specified by 'crawl-interval-hour' in program settings.
+    Every interval, a 'total-crawl' task is added to crawl queue (by one of workers).
+
+    The time range of a task starts at the end of last 'total-crawl' task in db,
+    so no interval is skipped when workers restart.
+    """
+
+    while True:
+        try:
+            last_until = await get_last_crawl_until('total-crawl')
+
+            #: sleep
+            await sleep_crawl_interval(last_until)
+
+            #: create crawl task and its jobs in db
+            task_id = await create_total_crawl_task(get_settings('crawl-interval-hour'))
+
+            if task_id is not None:
+                print(f'[total-crawl][task:{task_id}][queued crawl]')
+            else:
+                #: another worker created it, or jobs of last crawls are unfinished (retrying)
+                await asyncio.sleep(get_settings('crawl-queue-poll-second'))
+
+        except Exception as e:
+            print(f'[total-crawl][error][{e}]')
+
+            await asyncio.sleep(get_settings('crawl-retry-delay-second'))
+
+
+async def partition_maintenance_runner():
+    """
+    creates partitions of next months and removes months out of retention (see i_partitions),
+    every 'partition-maintenance-interval-hour' hours (program settings).
+    """
+
+    while True:
+        try:
+            report = await maintain_tweet_partitions()
+            print(f'[partitions][{report}]')
+        except Exception as e:
+            print(f'[partitions][error][{e}]')
+
+        await asyncio.sleep(get_settings('partition-maintenance-interval-hour') * 3600)
+
+
+def prepare_metrics_server():
+    """
+    serves metrics of this worker
+    """
+    port = get_settings('worker-metrics-port')
+    if not port:
+        return
+
+    app = tornado.web.Application([
+        rout_url(r"/api/metrics", MetricsHandler),
+    ])
+
+    try:
+        app.listen(port)
+        print(f"[metrics][started on port: {port}]")
+    except OSError as e:
+        print(f'[metrics][error][{e}]')
+
+
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+
+    #: opens connections of db pool before crawling
+    loop.run_until_complete(init_db())
+
+    prepare_metrics_server()
+    loop.create_task(monitor_event_loop_lag())
+
+    loop.create_task(run_crawl_queue())
+    loop.create_task(total_crawl_runner())
+    loop.create_task(partition_maintenance_runner())
+
+    subscribe_settings(lambda settings: settings_changed.set())
+    loop.create_task(watch_settings())
+
+    #: dictionary changes of api server
+    subscribe_dictionary_events()
+    loop.create_task(listen_events())
+
+    loop.run_forever()